@@ -0,0 +1,100 @@
+"""
+Import time of the ipynb Pelican plugin, measured with `python -X importtime`
+
+Pelican itself is imported first so only the plugin's own cost is reported.
+With --rev the plugin of another git revision is measured as well, e.g.
+
+    python benchmarks/bench_import_time.py --rev HEAD~1 [--runs 5]
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def import_times(plugins_path):
+    """
+    Cumulative import time in us of every module imported by the plugin
+    Return: (top level modules, all modules)
+    """
+    code = 'import pelican; import ipynb.markup'
+    env = dict(os.environ, PYTHONPATH=plugins_path, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    nested = {}
+    seen_pelican = False
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        if name == 'pelican' and not indent:
+            seen_pelican = True
+        elif seen_pelican:
+            nested[name] = cumulative
+            if not indent:
+                times[name] = cumulative
+    return times, nested
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(plugins_path, runs):
+    runs = [import_times(plugins_path) for _ in range(runs)]
+    total = median([sum(times.values()) for times, _ in runs])
+    heaviest = sorted(((name, cumulative) for name, cumulative in runs[-1][1].items()
+                       if not name.startswith('ipynb')), key=lambda item: -item[1])[:5]
+    return total, heaviest
+
+
+def export_plugins(rev, directory):
+    """Extract plugins/ipynb of a git revision into `directory`"""
+    archive = subprocess.run(['git', 'archive', rev, 'plugins/ipynb'], cwd=ROOT,
+                             stdout=subprocess.PIPE, check=True).stdout
+    archive_path = os.path.join(directory, 'plugins.tar')
+    with open(archive_path, 'wb') as outp:
+        outp.write(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, 'plugins')
+
+
+def report(label, plugins_path, runs):
+    total, heaviest = measure(plugins_path, runs)
+    print('{}: {:.1f} ms after pelican'.format(label, total / 1e3))
+    for name, cumulative in heaviest:
+        print('    {:<30} {:8.1f} ms'.format(name, cumulative / 1e3))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rev', help='also measure the plugin at this git revision')
+    parser.add_argument('--runs', type=int, default=5, help='runs per measurement, the median is reported')
+    args = parser.parse_args()
+
+    current = report('working tree', os.path.join(ROOT, 'plugins'), args.runs)
+    if args.rev:
+        directory = tempfile.mkdtemp()
+        try:
+            previous = report(args.rev, export_plugins(args.rev, directory), args.runs)
+        finally:
+            shutil.rmtree(directory)
+        print('speedup: {:.1f}x'.format(previous / float(current)))
+
+
+if __name__ == '__main__':
+    main()
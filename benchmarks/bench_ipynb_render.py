@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the notebook to HTML conversion in plugins/ipynb/core.py
+
+Times a conversion with a freshly built HTMLExporter (what every call used to
+do) against the pooled exporter, and highlighting every code cell with
+nbconvert's Highlight2HTML against the cached highlighter.
+
+    python benchmarks/bench_ipynb_render.py [notebook.ipynb ...]
+"""
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'plugins'))
+
+import nbformat
+from nbconvert.exporters import HTMLExporter
+from nbconvert.filters.highlight import Highlight2HTML
+from traitlets.config import Config
+
+from ipynb.core import custom_highlighter, get_highlighter, get_html_from_filepath
+from ipynb.exporter import SubCell
+
+
+def fresh_exporter_html(filepath):
+    config = Config({'CSSHTMLHeaderTransformer': {'enabled': True,
+                     'highlight_class': '.highlight-ipynb'},
+                     'SubCell': {'enabled': True, 'start': 0, 'end': None}})
+    exporter = HTMLExporter(config=config, template_file='basic',
+                            filters={'highlight2html': custom_highlighter},
+                            preprocessors=[SubCell])
+    return exporter.from_filename(filepath)
+
+
+def main(paths):
+    paths = paths or sorted(glob.glob(os.path.join(ROOT, 'content', '*.ipynb')))
+    number = 5
+
+    fresh = timeit.timeit(lambda: [fresh_exporter_html(path) for path in paths], number=number)
+    get_html_from_filepath(paths[0])  # build the pooled exporter once
+    pooled = timeit.timeit(lambda: [get_html_from_filepath(path) for path in paths], number=number)
+    print('per notebook: fresh exporter {:.1f} ms, pooled exporter {:.1f} ms'.format(
+        fresh / number / len(paths) * 1e3, pooled / number / len(paths) * 1e3))
+
+    cells = []
+    for path in paths:
+        nb = nbformat.read(path, as_version=4)
+        langinfo = nb.metadata.get('language_info', {})
+        lexer = langinfo.get('pygments_lexer', langinfo.get('name', None))
+        cells.extend((lexer, cell.source) for cell in nb.cells if cell.cell_type == 'code')
+
+    # nbconvert builds one Highlight2HTML per notebook, and a formatter and lexer per cell
+    highlighters = {lexer: Highlight2HTML(pygments_lexer=lexer) for lexer, _ in cells}
+    nbconvert_time = timeit.timeit(lambda: [highlighters[lexer](source)
+                                            for lexer, source in cells], number=number)
+    cached_time = timeit.timeit(lambda: [get_highlighter(lexer)(source)
+                                         for lexer, source in cells], number=number)
+    print('per code cell: Highlight2HTML {:.0f} us, cached highlighter {:.0f} us'.format(
+        nbconvert_time / number / len(cells) * 1e6, cached_time / number / len(cells) * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
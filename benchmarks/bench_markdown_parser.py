@@ -0,0 +1,87 @@
+"""
+Differential check and benchmark of SimpleMarkdownParser.get_cleaned_text
+
+Compares the parser against the original regex pipeline on every
+markdown cell of the notebooks in `notebooks/` plus random strings built
+from markdown punctuation, and times both.
+
+    python benchmarks/bench_markdown_parser.py
+"""
+import glob
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parsers.markdown_parser import SimpleMarkdownParser
+
+
+class ReferenceMarkdownCleaner():
+    """The original get_cleaned_text, kept as the reference output"""
+
+    def __init__(self):
+        self._main_header_pattern = re.compile("^#\W([\w \.\,\!\;\:\-\_\'\\\"]+)")
+        self._subheader_pattern = re.compile("^##+\W|##+\W")
+        self._linebreak_pattern = re.compile("\n==+\n|^==+\n|\n--+\n|^--+\n")
+        self._strong_emphasis_pattern = re.compile("\*{2}|\_{2}([\w \.\,\!\;\:\-\'\\\"]+)\*{2}|\_{2}")
+        self._emphasis_pattern = re.compile("\*|\_([\w \.\,\!\;\:\-\'\\\"]+)\*|\_")
+        self._inline_pattern = re.compile("\`([\w \.\,\!\;\:\-\'\\\"]+)\`")
+        self._strikethrough_pattern = re.compile("\~\~([\w \.\,\!\;\:\-\'\\\"]+)\~\~")
+        self._url_pattern = re.compile("\[([\w \.\,\!\;\:\-\'\\\"]+)\]\(([\w \.\,\!\;\:\/]+)\)")
+
+    def get_cleaned_text(self, text):
+        text = self._main_header_pattern.sub('', text)
+        text = self._subheader_pattern.sub('', text)
+        text = self._linebreak_pattern.sub('', text)
+        text = self._strong_emphasis_pattern.sub(r'\1', text)
+        text = self._emphasis_pattern.sub(r'\1', text)
+        text = self._strikethrough_pattern.sub(r'\1', text)
+        text = self._inline_pattern.sub(r'\1', text)
+        text = self._url_pattern.sub(r'\1', text)
+        return text.strip().lstrip()
+
+
+def load_markdown_cells(notebook_path='notebooks/'):
+    cells = []
+    for file_path in sorted(glob.glob(os.path.join(notebook_path, '*.ipynb'))):
+        with open(file_path) as inp:
+            notebook = json.load(inp)
+        for cell in notebook.get('cells', []):
+            if cell.get('cell_type') == 'markdown':
+                source = cell.get('source')
+                cells.append(''.join(source) if isinstance(source, list) else source)
+    return cells
+
+
+def random_markdown(count, seed=0):
+    pieces = list('#=-*_~`[]()!\n .:/\'"ab') + ['##', '**', '__', '~~', '\n==\n', '\n--\n', '](', 'word']
+    rng = random.Random(seed)
+    return [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 30))) for _ in range(count)]
+
+
+def main():
+    parser = SimpleMarkdownParser()
+    reference = ReferenceMarkdownCleaner()
+    cells = load_markdown_cells()
+
+    mismatches = [cell for cell in cells + random_markdown(50000) if parser.get_cleaned_text(cell) != reference.get_cleaned_text(cell)]
+    print('{} markdown cells and 50000 random strings, {} mismatches'.format(len(cells), len(mismatches)))
+    for cell in mismatches[:5]:
+        print(repr(cell[:200]))
+
+    document = '\n'.join(cells) * 50
+    for name, cleaner in (('reference', reference), ('parser', parser)):
+        per_cell = timeit.timeit(lambda: [cleaner.get_cleaned_text(cell) for cell in cells], number=200)
+        joined = timeit.timeit(lambda: cleaner.get_cleaned_text(document), number=10)
+        print('{:10} per cell: {:.1f} us, {} chars: {:.1f} ms'.format(
+            name, per_cell / 200 / max(len(cells), 1) * 1e6, len(document), joined / 10 * 1e3))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Benchmark suite of the publishing pipeline on a synthetic notebook corpus
+
+Times publish.py (cold and warm), the markdown and python parsers and, when
+nbconvert and pelican are installed, the ipynb plugin rendering, CSS fixes and
+summary extraction. Every benchmark reports the best of --repeat runs.
+
+    python benchmarks/bench_suite.py --save baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json [--threshold 0.15]
+
+--compare exits with status 1 if a benchmark got slower than the threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'plugins'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import add_corpus_arguments, corpus_options, write_corpus
+from parsers.markdown_parser import SimpleMarkdownParser
+from parsers.python3_parser import SimplePython3Parser
+from publish import Publisher
+
+BENCHMARKS = OrderedDict()
+
+
+class Skip(Exception):
+    """A benchmark that cannot run here (missing optional dependency)"""
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+class Corpus():
+
+    def __init__(self, directory, paths):
+        self.directory = directory
+        self.paths = paths
+        self.notebooks = []
+        for path in paths:
+            with open(path) as inp:
+                self.notebooks.append(json.load(inp))
+        self._rendered = None
+
+    def sources(self, cell_type):
+        return [cell['source'] for notebook in self.notebooks
+                for cell in notebook['cells'] if cell['cell_type'] == cell_type]
+
+    def rendered(self):
+        """(filepath, content, info) of every notebook, rendered once for the benchmarks that need it"""
+        if self._rendered is None:
+            get_html_from_filepath = import_plugin().get_html_from_filepath
+            self._rendered = [(path,) + get_html_from_filepath(path) for path in self.paths]
+        return self._rendered
+
+
+def import_plugin(module='core'):
+    try:
+        import nbconvert  # noqa
+        if module == 'markup':
+            import pelican  # noqa
+    except ImportError as e:
+        raise Skip(str(e))
+    return __import__('ipynb.' + module, fromlist=['ipynb'])
+
+
+def make_publisher(directory, notebook_path):
+    content_path = os.path.join(directory, 'content') + os.sep
+    index_path = os.path.join(directory, 'output', 'search', 'index.json')
+    for path in (content_path, os.path.dirname(index_path)):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    return Publisher(content_path=content_path,
+                     notebook_path=notebook_path + os.sep,
+                     index_file_path=index_path,
+                     manifest_file_path=os.path.join(directory, 'publish-manifest.json'))
+
+
+@benchmark('publish cold')
+def bench_publish_cold(corpus, work_dir):
+    directory = tempfile.mkdtemp(dir=work_dir)
+    publisher = make_publisher(directory, corpus.directory)
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        publisher.publish()
+        return time.perf_counter() - start
+
+
+@benchmark('publish warm')
+def bench_publish_warm(corpus, work_dir):
+    directory = os.path.join(work_dir, 'warm')
+    if not os.path.isdir(directory):
+        with redirect_stdout(io.StringIO()):
+            make_publisher(directory, corpus.directory).publish()
+    publisher = make_publisher(directory, corpus.directory)
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        publisher.publish()
+        return time.perf_counter() - start
+
+
+@benchmark('markdown process')
+def bench_markdown(corpus, work_dir):
+    sources = corpus.sources('markdown')
+    parser = SimpleMarkdownParser()
+    start = time.perf_counter()
+    for source in sources:
+        parser.process(source)
+    return time.perf_counter() - start
+
+
+@benchmark('python3 process')
+def bench_python3(corpus, work_dir):
+    sources = corpus.sources('code')
+    # a new parser so its per cell cache starts empty
+    parser = SimplePython3Parser()
+    start = time.perf_counter()
+    for source in sources:
+        parser.process(source)
+    return time.perf_counter() - start
+
+
+@benchmark('get_html_from_filepath')
+def bench_render(corpus, work_dir):
+    core = import_plugin()
+    core.get_html_from_filepath(corpus.paths[0])  # imports and the shared exporter
+    start = time.perf_counter()
+    for path in corpus.paths:
+        core.get_html_from_filepath(path)
+    return time.perf_counter() - start
+
+
+@benchmark('fix_css')
+def bench_fix_css(corpus, work_dir):
+    core = import_plugin()
+    rendered = corpus.rendered()
+    start = time.perf_counter()
+    for _, content, info in rendered:
+        core.fix_css(content, info)
+    return time.perf_counter() - start
+
+
+@benchmark('summary')
+def bench_summary(corpus, work_dir):
+    markup = import_plugin('markup')
+    from pelican.settings import DEFAULT_CONFIG
+    settings = dict(DEFAULT_CONFIG)
+    rendered = corpus.rendered()
+    start = time.perf_counter()
+    for path, content, _ in rendered:
+        parser = markup.MyHTMLParser(settings, os.path.basename(path))
+        parser.feed_summary('<body>{0}</body>'.format(content))
+    return time.perf_counter() - start
+
+
+def run(corpus, work_dir, names, repeat):
+    results = OrderedDict()
+    for name in names:
+        try:
+            runs = [BENCHMARKS[name](corpus, work_dir) for _ in range(repeat)]
+        except Skip as e:
+            print('{:<24} skipped ({})'.format(name, e))
+            continue
+        results[name] = {'seconds': min(runs), 'runs': runs}
+        print('{:<24} {:10.2f} ms'.format(name, min(runs) * 1e3))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every benchmark, return the names of the regressions"""
+    regressions = []
+    print('')
+    print('{:<24} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline ms', 'current ms', 'change'))
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['seconds']
+        change = result['seconds'] / before - 1 if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<24} {:12.2f} {:12.2f} {:>+7.0%}{}'.format(name, before * 1e3, result['seconds'] * 1e3, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the notebook publishing pipeline')
+    add_corpus_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best is kept')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--save', metavar='JSON', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='slowdown reported as a regression, 0.15 is 15%% slower')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='notes-bench-')
+    try:
+        options = corpus_options(args)
+        corpus = Corpus(os.path.join(work_dir, 'notebooks'),
+                        write_corpus(os.path.join(work_dir, 'notebooks'), **options))
+        print('{notebooks} notebooks of {cells} cells, {markdown_ratio:.0%} markdown, '
+              '{image_size} byte images'.format(**options))
+        results = run(corpus, work_dir, args.only or list(BENCHMARKS), args.repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {'date': datetime.now().isoformat(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'corpus': options, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as outp:
+            json.dump(report, outp, indent=4)
+    if args.compare:
+        with open(args.compare) as inp:
+            baseline = json.load(inp)
+        if baseline.get('corpus') != options:
+            print('warning: the baseline was measured on a different corpus')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
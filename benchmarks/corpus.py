@@ -0,0 +1,145 @@
+"""
+Synthetic notebook corpus for the benchmarks
+
+Writes nbformat 4 notebooks (plain JSON, nbformat is not needed) with a
+configurable number of cells, share of markdown cells, image output size and
+text output size. The same seed always gives the same corpus.
+
+    python benchmarks/corpus.py OUTPUT_DIR [--notebooks 20] [--cells 40] [--markdown-ratio 0.4]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+
+WORDS = ('notebook', 'matrix', 'tensor', 'regular', 'expression', 'python', 'encryption', 'prime',
+         'vector', 'gradient', 'function', 'value', 'search', 'index', 'page', 'model', 'data')
+
+PACKAGES = ('numpy', 'torch', 'os', 're', 'json', 'collections', 'itertools', 'requests')
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def markdown_source(rng, first=False):
+    lines = []
+    if first:
+        lines.append('# ' + words(rng, 4).capitalize())
+    elif rng.random() < 0.3:
+        lines.append('## ' + words(rng, 3).capitalize())
+    for _ in range(rng.randint(1, 4)):
+        sentence = words(rng, rng.randint(8, 30)).split(' ')
+        sentence[rng.randrange(len(sentence))] = '**{}**'.format(rng.choice(WORDS))
+        sentence[rng.randrange(len(sentence))] = '`{}()`'.format(rng.choice(WORDS))
+        if rng.random() < 0.3:
+            sentence.append('[{}](https://example.com/{})'.format(rng.choice(WORDS), rng.choice(WORDS)))
+        if rng.random() < 0.2:
+            sentence.append('$x_{} = {}^2$'.format(rng.randint(0, 9), rng.choice(WORDS)))
+        lines.append(' '.join(sentence) + '.')
+    if rng.random() < 0.2:
+        lines.extend('- ' + words(rng, 5) for _ in range(3))
+    return '\n\n'.join(lines)
+
+
+def code_source(rng):
+    lines = []
+    if rng.random() < 0.3:
+        lines.append('import {}'.format(rng.choice(PACKAGES)))
+    if rng.random() < 0.2:
+        lines.append('from {} import {}'.format(rng.choice(PACKAGES), rng.choice(WORDS)))
+    if rng.random() < 0.05:
+        lines.append('%matplotlib inline')
+    if rng.random() < 0.2:
+        lines.append('class {}(object):'.format(rng.choice(WORDS).capitalize()))
+        lines.append('    def {}(self, {}):'.format(rng.choice(WORDS), rng.choice(WORDS)))
+        lines.append('        return self.{} * 2'.format(rng.choice(WORDS)))
+    for _ in range(rng.randint(1, 8)):
+        lines.append('{} = {}({}, {!r})'.format(rng.choice(WORDS), rng.choice(WORDS),
+                                                 rng.randint(0, 100), rng.choice(WORDS)))
+    lines.append('print({})'.format(rng.choice(WORDS)))
+    return '\n'.join(lines)
+
+
+def outputs(rng, execution_count, image_size, text_output_size):
+    result = []
+    if rng.random() < 0.5:
+        result.append({'output_type': 'stream', 'name': 'stdout',
+                       'text': words(rng, max(1, text_output_size // 8))})
+    if image_size and rng.random() < 0.2:
+        image = PNG_HEADER + rng.getrandbits(8 * image_size).to_bytes(image_size, 'little')
+        result.append({'output_type': 'display_data', 'metadata': {},
+                       'data': {'image/png': base64.b64encode(image).decode('ascii'),
+                                'text/plain': '<matplotlib.figure.Figure at 0x10>'}})
+    elif rng.random() < 0.3:
+        result.append({'output_type': 'execute_result', 'execution_count': execution_count, 'metadata': {},
+                       'data': {'text/plain': repr([rng.random() for _ in range(rng.randint(1, 20))])}})
+    return result
+
+
+def make_notebook(rng, cells=40, markdown_ratio=0.4, image_size=20000, text_output_size=200):
+    notebook_cells = []
+    execution_count = 0
+    for index in range(cells):
+        if index == 0 or rng.random() < markdown_ratio:
+            notebook_cells.append({'cell_type': 'markdown', 'metadata': {},
+                                   'source': markdown_source(rng, first=index == 0)})
+        else:
+            execution_count += 1
+            notebook_cells.append({'cell_type': 'code', 'execution_count': execution_count, 'metadata': {},
+                                   'source': code_source(rng),
+                                   'outputs': outputs(rng, execution_count, image_size, text_output_size)})
+    return {
+        'cells': notebook_cells,
+        'metadata': {
+            'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'},
+            'language_info': {'codemirror_mode': {'name': 'ipython', 'version': 3},
+                              'file_extension': '.py', 'mimetype': 'text/x-python', 'name': 'python',
+                              'nbconvert_exporter': 'python', 'pygments_lexer': 'ipython3',
+                              'version': '3.6.3'}
+        },
+        'nbformat': 4,
+        'nbformat_minor': 2
+    }
+
+
+def write_corpus(directory, notebooks=20, cells=40, markdown_ratio=0.4, image_size=20000,
+                 text_output_size=200, seed=0):
+    """Write the corpus to `directory`, return the notebook paths"""
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for index in range(notebooks):
+        path = os.path.join(directory, 'notebook_{:04d}.ipynb'.format(index))
+        with open(path, 'w') as outp:
+            json.dump(make_notebook(rng, cells, markdown_ratio, image_size, text_output_size), outp, indent=1)
+        paths.append(path)
+    return paths
+
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--notebooks', type=int, default=20, help='number of notebooks')
+    parser.add_argument('--cells', type=int, default=40, help='cells per notebook')
+    parser.add_argument('--markdown-ratio', type=float, default=0.4, help='share of markdown cells')
+    parser.add_argument('--image-size', type=int, default=20000,
+                        help='bytes of the image outputs, 0 for no images')
+    parser.add_argument('--text-output-size', type=int, default=200, help='characters of the stream outputs')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def corpus_options(args):
+    return {'notebooks': args.notebooks, 'cells': args.cells, 'markdown_ratio': args.markdown_ratio,
+            'image_size': args.image_size, 'text_output_size': args.text_output_size, 'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic notebook corpus')
+    parser.add_argument('directory')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    paths = write_corpus(args.directory, **corpus_options(args))
+    print('{} notebooks written to {}'.format(len(paths), args.directory))
@@ -0,0 +1,195 @@
+"""
+Write precompressed `.gz` and `.br` files next to the compressible files of the generated site
+
+Only files whose content changed since the last run are compressed again
+(their hashes are kept in `cache/compress-manifest.json`), in parallel and at
+the highest levels since it happens once per build. Brotli files are written
+when the `brotli` package is installed.
+
+    python compress.py [output] [-j JOBS] [--min-size 256]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.html', '.htm', '.css', '.js', '.json', '.xml', '.svg', '.txt', '.md',
+                '.ipynb', '.map', '.ico', '.ttf', '.otf', '.eot')
+
+
+def gzip_compress(data):
+    out = io.BytesIO()
+    # mtime=0 so the same content always gives the same file (rsync -c, git)
+    with gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=9, mtime=0) as outp:
+        outp.write(data)
+    return out.getvalue()
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+def encoders():
+    """(suffix, compress function) of the available encodings"""
+    result = [('.gz', gzip_compress)]
+    if brotli is not None:
+        result.append(('.br', brotli_compress))
+    return result
+
+
+def write_sibling(file_path, suffix, data, stat):
+    sibling = file_path + suffix
+    tmp_path = sibling + '.tmp'
+    with open(tmp_path, 'wb') as outp:
+        outp.write(data)
+    os.replace(tmp_path, sibling)
+    # same mtime as the file so servers don't take it for stale
+    os.utime(sibling, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def remove_sibling(file_path, suffix):
+    try:
+        os.remove(file_path + suffix)
+    except FileNotFoundError:
+        pass
+
+
+def compress_file(file_path):
+    """
+    Write the siblings of file_path, skip the ones not smaller than the file
+    Return: (saved bytes, suffixes of the written siblings)
+    """
+    with open(file_path, 'rb') as inp:
+        data = inp.read()
+    stat = os.stat(file_path)
+    saved = 0
+    written = []
+    for suffix, compress in encoders():
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            write_sibling(file_path, suffix, compressed, stat)
+            saved += len(data) - len(compressed)
+            written.append(suffix)
+        else:
+            remove_sibling(file_path, suffix)
+    return saved, written
+
+
+class Compressor():
+    """
+    Compresses the files of the output directory that changed since the last run
+
+    The manifest maps every file to the hash of its content and the suffixes of
+    the siblings written for it, none for files that don't get smaller.
+    """
+    version = 2
+
+    def __init__(self, output_path='output', manifest_file_path='cache/compress-manifest.json',
+                 jobs=None, min_size=256):
+        self.output_path = output_path
+        self.manifest_file_path = manifest_file_path
+        self.jobs = jobs or os.cpu_count()
+        self.min_size = min_size
+        self.manifest = {}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file_path) as inp:
+                manifest = json.load(inp)
+        except (IOError, ValueError):
+            return
+        # compressed with other encoders, everything has to be redone
+        if manifest.get('version') == self.version and \
+                manifest.get('suffixes') == [suffix for suffix, _ in encoders()]:
+            self.manifest = manifest.get('files', {})
+
+    def _save_manifest(self):
+        directory = os.path.dirname(self.manifest_file_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.manifest_file_path + '.tmp'
+        with open(tmp_path, 'w') as outp:
+            json.dump({'version': self.version, 'suffixes': [suffix for suffix, _ in encoders()],
+                       'files': self.manifest}, outp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_file_path)
+
+    def _files(self):
+        for root, _, file_names in os.walk(self.output_path):
+            for file_name in file_names:
+                if file_name.lower().endswith(COMPRESSIBLE):
+                    file_path = os.path.join(root, file_name)
+                    if os.path.getsize(file_path) >= self.min_size:
+                        yield file_path
+
+    def _up_to_date(self, file_path, entry, file_hash):
+        """True if the siblings exist for this content, their mtime is fixed up if the file was rewritten"""
+        if entry is None or entry['hash'] != file_hash:
+            return False
+        siblings = [file_path + suffix for suffix in entry['siblings']]
+        if not all(os.path.exists(sibling) for sibling in siblings):
+            # deleted with the output directory
+            return False
+        stat = os.stat(file_path)
+        for sibling in siblings:
+            os.utime(sibling, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        return True
+
+    def compress(self):
+        self._load_manifest()
+        manifest = {}
+        changed = []
+        for file_path in self._files():
+            relative_path = os.path.relpath(file_path, self.output_path)
+            with open(file_path, 'rb') as inp:
+                file_hash = hashlib.sha1(inp.read()).hexdigest()
+            entry = self.manifest.get(relative_path)
+            if self._up_to_date(file_path, entry, file_hash):
+                manifest[relative_path] = entry
+            else:
+                changed.append((file_path, relative_path, file_hash))
+
+        # siblings of files that are gone
+        for relative_path in set(self.manifest) - set(manifest):
+            for suffix, _ in encoders():
+                remove_sibling(os.path.join(self.output_path, relative_path), suffix)
+
+        changed_paths = [file_path for file_path, _, _ in changed]
+        if self.jobs > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(changed))) as executor:
+                results = list(executor.map(compress_file, changed_paths, chunksize=8))
+        else:
+            results = list(map(compress_file, changed_paths))
+
+        saved = 0
+        for (_, relative_path, file_hash), (file_saved, suffixes) in zip(changed, results):
+            manifest[relative_path] = {'hash': file_hash, 'siblings': suffixes}
+            saved += file_saved
+
+        self.manifest = manifest
+        self._save_manifest()
+        print('compressed {} of {} files ({}), {} KB saved'.format(
+            len(changed), len(manifest), ', '.join(suffix for suffix, _ in encoders()), saved // 1024))
+        return changed_paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompress the generated site')
+    parser.add_argument('output', nargs='?', default='output', help='directory of the generated site')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='worker processes, 0 uses all cores and 1 compresses serially')
+    parser.add_argument('--min-size', type=int, default=256, help='files smaller than this are left alone')
+    parser.add_argument('--manifest', default='cache/compress-manifest.json',
+                        help='hashes of the compressed files')
+    args = parser.parse_args()
+    if brotli is None:
+        sys.stderr.write('brotli is not installed, only writing .gz files\n')
+    Compressor(args.output, args.manifest, jobs=args.jobs or os.cpu_count(), min_size=args.min_size).compress()
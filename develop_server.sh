@@ -5,6 +5,7 @@
 PY=${PY:-python3}
 PELICAN=${PELICAN:-pelican}
 PELICANOPTS=
+PUBLISHOPTS=${PUBLISHOPTS:-}
 
 BASEDIR=$(pwd)
 INPUTDIR=$BASEDIR/content
@@ -17,11 +18,13 @@ CONFFILE=$BASEDIR/pelicanconf.py
 
 SRV_PID=$BASEDIR/srv.pid
 PELICAN_PID=$BASEDIR/pelican.pid
+PUBLISH_PID=$BASEDIR/publish.pid
 
 function usage(){
   echo "usage: $0 (stop) (start) (restart) [port]"
   echo "This starts Pelican in debug and reload mode and then launches"
-  echo "an HTTP server to help site development. It doesn't read"
+  echo "an HTTP server to help site development. Notebooks are published"
+  echo "to the content as they are saved (publish.py --watch). It doesn't read"
   echo "your Pelican settings, so if you edit any paths in your Makefile"
   echo "you will need to edit your settings as well."
   exit 3
@@ -57,29 +60,47 @@ function shut_down(){
   else
     echo "Pelican PIDFile not found"
   fi
+
+  PID=$(cat $PUBLISH_PID)
+  if [[ $? -eq 0 ]]; then
+    if alive $PID; then
+      echo "Stopping notebook watcher"
+      kill $PID
+    else
+      echo "Stale PID, deleting"
+    fi
+    rm $PUBLISH_PID
+  else
+    echo "Notebook watcher PIDFile not found"
+  fi
 }
 
 function start_up(){
   local port=$1
-  echo "Starting up Pelican and HTTP server"
+  echo "Starting up notebook watcher, Pelican and HTTP server"
   shift
+  $PY publish.py --watch $PUBLISHOPTS &
+  publish_pid=$!
+  echo $publish_pid > $PUBLISH_PID
   $PELICAN --debug --autoreload -r $INPUTDIR -o $OUTPUTDIR -s $CONFFILE $PELICANOPTS &
   pelican_pid=$!
   echo $pelican_pid > $PELICAN_PID
-  mkdir -p $OUTPUTDIR && cd $OUTPUTDIR
-  $PY -m pelican.server $port &
+  mkdir -p $OUTPUTDIR
+  $PY server.py -d $OUTPUTDIR $port &
   srv_pid=$!
   echo $srv_pid > $SRV_PID
-  cd $BASEDIR
   sleep 1
-  if ! alive $pelican_pid ; then
+  if ! alive $publish_pid ; then
+    echo "The notebook watcher didn't start."
+    return 1
+  elif ! alive $pelican_pid ; then
     echo "Pelican didn't start. Is the Pelican package installed?"
     return 1
   elif ! alive $srv_pid ; then
     echo "The HTTP server didn't start. Is there another service using port" $port "?"
     return 1
   fi
-  echo 'Pelican and HTTP server processes now running in background.'
+  echo 'Notebook watcher, Pelican and HTTP server processes now running in background.'
 }
 
 ###
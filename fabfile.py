@@ -2,10 +2,6 @@ from fabric.api import *
 import fabric.contrib.project as project
 import os
 import shutil
-import sys
-import SocketServer
-
-from pelican.server import ComplexHTTPRequestHandler
 
 # Local path configuration (can be absolute or relative to fabfile)
 env.deploy_path = 'output'
@@ -45,16 +41,8 @@ def regenerate():
     local('pelican -r -s pelicanconf.py')
 
 def serve():
-    """Serve site at http://localhost:8000/"""
-    os.chdir(env.deploy_path)
-
-    class AddressReuseTCPServer(SocketServer.TCPServer):
-        allow_reuse_address = True
-
-    server = AddressReuseTCPServer(('', PORT), ComplexHTTPRequestHandler)
-
-    sys.stderr.write('Serving on port {0} ...\n'.format(PORT))
-    server.serve_forever()
+    """Serve site at http://localhost:8000/ with server.py"""
+    local('python3 server.py -d {deploy_path} {port}'.format(port=PORT, **env))
 
 def reserve():
     """`build`, then `serve`"""
@@ -78,6 +66,7 @@ def cf_upload():
 def publish():
     """Publish to production via rsync"""
     local('pelican -s publishconf.py')
+    local('python3 compress.py {deploy_path}'.format(**env))
     project.rsync_project(
         remote_dir=dest_path,
         exclude=".DS_Store",
@@ -2,12 +2,17 @@ import re
 
 
 class SimpleMarkdownParser():
+    # bump when the output changes so published notebooks get reprocessed
+    VERSION = 1
 
     def __init__(self):
         self._main_header_pattern = re.compile("^#\W([\w \.\,\!\;\:\-\_\'\\\"]+)")
-        self._subheader_pattern = re.compile("^##+\W|##+\W")
-        self._linebreak_pattern = re.compile("\n==+\n|^==+\n|\n--+\n|^--+\n")
-        self._strong_emphasis_pattern = re.compile("\*{2}|\_{2}([\w \.\,\!\;\:\-\'\\\"]+)\*{2}|\_{2}")
+        # every alternative starts with a literal so the regex engine can skip
+        # ahead to candidate positions instead of trying the match everywhere
+        self._subheader_pattern = re.compile("##+\W")
+        self._linebreak_start_pattern = re.compile("(==+|--+)\n")
+        self._linebreak_pattern = re.compile("\n(==+|--+)\n")
+        self._strong_emphasis_pattern = re.compile("\*\*|\_\_([\w \.\,\!\;\:\-\'\\\"]+)\*\*|\_\_")
         self._emphasis_pattern = re.compile("\*|\_([\w \.\,\!\;\:\-\'\\\"]+)\*|\_")
         self._inline_pattern = re.compile("\`([\w \.\,\!\;\:\-\'\\\"]+)\`")
         self._strikethrough_pattern = re.compile("\~\~([\w \.\,\!\;\:\-\'\\\"]+)\~\~")
@@ -18,18 +23,32 @@ class SimpleMarkdownParser():
         pass
 
     def get_cleaned_text(self, text):
+        # Passes run in order since each one sees the output of the previous,
+        # but a pass is skipped when the literal it needs is not in the text.
+        # Passes only delete characters, so a skipped pass could never match.
         # clean header info
-        text = self._main_header_pattern.sub('', text)
-        text = self._subheader_pattern.sub('', text)
+        if text[:1] == '#':
+            text = self._main_header_pattern.sub('', text)
+        if '##' in text:
+            text = self._subheader_pattern.sub('', text)
         # clean line breaks
-        text = self._linebreak_pattern.sub('', text)
+        match = self._linebreak_start_pattern.match(text)
+        if match:
+            text = text[match.end():]
+        if '\n==' in text or '\n--' in text:
+            text = self._linebreak_pattern.sub('', text)
         # clean emphasis
-        text = self._strong_emphasis_pattern.sub(r'\1', text)
-        text = self._emphasis_pattern.sub(r'\1', text)
-        text = self._strikethrough_pattern.sub(r'\1', text)
-        text = self._inline_pattern.sub(r'\1', text)
+        if '**' in text or '__' in text:
+            text = self._strong_emphasis_pattern.sub(r'\1', text)
+        if '*' in text or '_' in text:
+            text = self._emphasis_pattern.sub(r'\1', text)
+        if '~~' in text:
+            text = self._strikethrough_pattern.sub(r'\1', text)
+        if '`' in text:
+            text = self._inline_pattern.sub(r'\1', text)
         # ignore urls
-        text = self._url_pattern.sub(r'\1', text)
+        if '](' in text:
+            text = self._url_pattern.sub(r'\1', text)
 
         return text.strip().lstrip()
 
@@ -47,6 +66,8 @@ class SimpleMarkdownParser():
                 get_title=True,
                 get_cleaned_text=True):
 
+        title = ""
+        cleaned_text = ""
         if get_title:
             title = self.match_title(text)
         if get_cleaned_text:
@@ -54,6 +75,34 @@ class SimpleMarkdownParser():
 
         return title, cleaned_text
 
+    def process_many(self, texts,
+                     get_title=True,
+                     get_cleaned_text=True):
+        """Process all markdown cells of a notebook at once
+
+        Returns the first title, the first non empty cleaned text (summary)
+        and the cleaned texts joined, each cell prefixed with a new line.
+        Without get_cleaned_text it stops as soon as title and summary are found.
+        """
+        title = ""
+        summary = ""
+        cleaned_texts = []
+        for text in texts:
+            if get_title and not title:
+                title = self.match_title(text)
+            if summary and not get_cleaned_text:
+                if title or not get_title:
+                    break
+                continue
+            cleaned_text = self.get_cleaned_text(text)
+            if not summary:
+                summary = cleaned_text
+            cleaned_texts.append(cleaned_text)
+
+        if not get_cleaned_text:
+            return title, summary, ""
+        return title, summary, ''.join('\n' + text for text in cleaned_texts)
+
     def text_get_cleaned_text(self):
         # test Headers
         test = '# title'
@@ -96,3 +145,24 @@ class SimpleMarkdownParser():
         test = 'some `inline` #items'
         res = self.get_cleaned_text(test)
         assert res == 'some inline #items'
+
+    def test_process_many(self):
+        texts = ['Intro without title', '# First title', '', '## Part\nsome **bold** text', '# Second title']
+        titles = [self.match_title(text) for text in texts]
+        cleaned_texts = [self.get_cleaned_text(text) for text in texts]
+        title = [title for title in titles if title][0]
+        summary = [text for text in cleaned_texts if text][0]
+        assert self.process_many(texts) == \
+            (title, summary, ''.join('\n' + text for text in cleaned_texts))
+        assert title == 'First title' and summary == 'Intro without title'
+
+        # stops once title and summary are known, the cleaned text is not built
+        assert self.process_many(texts, get_cleaned_text=False) == (title, summary, '')
+        res = self.process_many(texts, get_title=False)
+        assert res == ('', summary, ''.join('\n' + text for text in cleaned_texts))
+        assert self.process_many(texts, get_title=False, get_cleaned_text=False) == ('', summary, '')
+        # the summary skips empty cells
+        assert self.process_many(['', '# Title', 'Text'], get_cleaned_text=False) == ('Title', 'Text', '')
+
+        assert self.process_many([]) == ('', '', '')
+        assert self.process_many([], get_title=False, get_cleaned_text=False) == ('', '', '')
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from decimal import Decimal
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+NotebookSummary = namedtuple('NotebookSummary', ['nbformat', 'language_info', 'cells', 'content_hash'])
+
+
+class SimpleNotebookParser():
+    """Single pass reader for the parts of a notebook the publisher needs
+
+    Walks the JSON events of the `.ipynb` file (incrementally with ijson when
+    it is installed) and keeps only `(cell_type, source)` of every cell and the
+    notebook `language_info`, so large outputs are never built into objects.
+    """
+
+    VERSION = 2
+
+    # nbformat 4 keeps the cells at the top level, nbformat 3 inside worksheets
+    _cell_prefixes = ('cells.item', 'worksheets.item.cells.item')
+    _source_fields = ('source', 'source.item', 'input', 'input.item')
+    _language_info_prefix = 'metadata.language_info.'
+    _hashed_prefixes = ('cells', 'worksheets', 'metadata.language_info')
+
+    def _iter_events(self, value, prefix=''):
+        """Yield ijson style `(prefix, event, value)` tuples for a loaded JSON value"""
+        if isinstance(value, dict):
+            yield prefix, 'start_map', None
+            for key, item in value.items():
+                yield prefix, 'map_key', key
+                for event in self._iter_events(item, prefix + '.' + key if prefix else key):
+                    yield event
+            yield prefix, 'end_map', None
+        elif isinstance(value, list):
+            yield prefix, 'start_array', None
+            item_prefix = prefix + '.item' if prefix else 'item'
+            for item in value:
+                for event in self._iter_events(item, item_prefix):
+                    yield event
+            yield prefix, 'end_array', None
+        elif isinstance(value, bool):
+            yield prefix, 'boolean', value
+        elif value is None:
+            yield prefix, 'null', value
+        elif isinstance(value, (int, Decimal)):
+            yield prefix, 'number', value
+        else:
+            yield prefix, 'string', value
+
+    def _get_events(self, inp):
+        if ijson:
+            return ijson.parse(inp)
+        # floats as Decimal to match the values ijson produces
+        return self._iter_events(json.load(inp, parse_float=Decimal))
+
+    def _upgrade_cell(self, cell_type, source, level=None):
+        """`(cell_type, source)` of a cell as nbformat converts nbformat 3 cells to nbformat 4"""
+        if cell_type == 'heading':
+            return 'markdown', '{} {}'.format('#' * (level or 1), ' '.join(source.splitlines()))
+        if cell_type == 'html':
+            return 'markdown', source
+        return cell_type, source
+
+    def process(self, file_path):
+        nbformat_version = None
+        language_info = {}
+        cells = []
+        cell_type = None
+        level = None
+        source = []
+        content_hash = hashlib.sha1()
+
+        with open(file_path, 'rb') as inp:
+            for prefix, event, value in self._get_events(inp):
+                if prefix.startswith(self._hashed_prefixes):
+                    content_hash.update('{}\0{}\0{}\n'.format(prefix, event, value).encode('utf-8'))
+
+                if prefix in self._cell_prefixes:
+                    if event == 'start_map':
+                        cell_type = None
+                        level = None
+                        source = []
+                    elif event == 'end_map':
+                        cells.append(self._upgrade_cell(cell_type, ''.join(source), level))
+                elif event in ('string', 'number') and prefix.startswith(self._cell_prefixes):
+                    field = prefix.split('.item.', 1)[1] if prefix.startswith('cells') \
+                        else prefix.split('.cells.item.', 1)[1]
+                    if field == 'cell_type':
+                        cell_type = value
+                    elif field == 'level':
+                        level = int(value)
+                    elif field in self._source_fields and event == 'string':
+                        source.append(value)
+                elif prefix.startswith(self._language_info_prefix):
+                    key = prefix[len(self._language_info_prefix):]
+                    if '.' not in key and event in ('string', 'number', 'boolean'):
+                        language_info[key] = value
+                elif prefix == 'nbformat' and event == 'number':
+                    nbformat_version = int(value)
+
+        return NotebookSummary(nbformat_version, language_info, cells, content_hash.hexdigest())
+
+    def _process_test_notebook(self, notebook):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'test.ipynb')
+            with open(file_path, 'w') as outp:
+                json.dump(notebook, outp)
+            return self.process(file_path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_process(self):
+        notebook = {'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title\n', 'text']},
+                              {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'source': 'import os',
+                               'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': ['0.5\n']}]}],
+                    'metadata': {'kernelspec': {'name': 'python3'},
+                                 'language_info': {'name': 'python', 'version': '3.6.3',
+                                                   'codemirror_mode': {'name': 'ipython', 'version': 3}}},
+                    'nbformat': 4, 'nbformat_minor': 2}
+        summary = self._process_test_notebook(notebook)
+        assert summary.nbformat == 4
+        assert summary.language_info == {'name': 'python', 'version': '3.6.3'}
+        assert summary.cells == [('markdown', '# Title\ntext'), ('code', 'import os')]
+
+        # only the cells and language_info are hashed
+        notebook['metadata']['kernelspec']['name'] = 'other'
+        assert self._process_test_notebook(notebook).content_hash == summary.content_hash
+        notebook['cells'][1]['source'] = 'import sys'
+        assert self._process_test_notebook(notebook).content_hash != summary.content_hash
+
+    def test_process_nbformat3(self):
+        notebook = {'metadata': {'name': ''}, 'nbformat': 3, 'nbformat_minor': 0,
+                    'worksheets': [{'metadata': {}, 'cells': [
+                        {'cell_type': 'heading', 'level': 1, 'metadata': {}, 'source': ['Title']},
+                        {'cell_type': 'code', 'collapsed': False, 'input': ['import os\n', 'print(1.5)'],
+                         'language': 'python', 'metadata': {}, 'outputs': [], 'prompt_number': 1},
+                        {'cell_type': 'heading', 'level': 2, 'metadata': {}, 'source': ['Two\n', 'lines']}]}]}
+        summary = self._process_test_notebook(notebook)
+        assert summary.nbformat == 3
+        # heading cells become markdown headers, as nbformat.read(..., as_version=4) did
+        assert summary.cells == [('markdown', '# Title'), ('code', 'import os\nprint(1.5)'),
+                                 ('markdown', '## Two lines')]
@@ -1,47 +1,123 @@
+import ast
+import hashlib
+import io
 import re
+import tokenize
+from collections import OrderedDict
 
 
-class SimplePython3Parser():
+class SymbolCollector(ast.NodeVisitor):
+    """Collect imported packages, classes and functions in source order"""
 
     def __init__(self):
-        self.import_pattern1 = re.compile("^import ([\w\,\. ]+)$")
-        self.import_pattern2 = re.compile("^from ([\w\,\. ]+) import ([\w\,\. ]+)$")
-        self.class_pattern1 = re.compile("^class ([\w]+)[ ]*:$")
-        self.method_pattern1 = re.compile("^|\W+def ([\w\,\(\)\=]+)[ ]*:$")
-
-    def match_import(self, line):
-        packages = []
-        match = self.import_pattern1.search(line)
-        if match:
-            lib = match.group(1)
-            if ',' in lib:
-                lib = re.sub('\, +', ', ', lib)
-                libs = lib.split(',')
-                for item in libs:
-                    packages.append(item)
-            else:
-                packages.append(lib)
-
-        match = self.import_pattern2.search(line)
-        if match:
-            parentlib = match.group(1)
-            lib = match.group(2)
-            if ',' in lib:
-                lib = re.sub('\, +', ', ', lib)
-                libs = lib.split(',')
-                for item in libs:
-                    packages.append(parentlib + '.' + item)
-            else:
-                packages.append(parentlib + '.' + lib)
-        return packages
-
-    def match_class(self, line):
-        classes = []
-        match = self.class_pattern1.search(line)
-        if match:
-            class_name = match.group(1)
-            classes.append(class_name)
-        return classes
+        self.packages = []
+        self.classes = []
+        self.methods = []
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.packages.append(alias.name)
+
+    def visit_ImportFrom(self, node):
+        # relative imports keep their leading dots
+        parent = '.' * node.level + (node.module or '')
+        separator = '.' if node.module else ''
+        for alias in node.names:
+            self.packages.append(parent + separator + alias.name)
+
+    def visit_ClassDef(self, node):
+        self.classes.append(node.name)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self.methods.append(node.name)
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+class SimplePython3Parser():
+    VERSION = 3
+
+    def __init__(self, cache_size=4096):
+        # IPython line magics, shell escapes and help lookups (`obj?`, `obj??`, `?obj`)
+        self._magic_pattern = re.compile(r"^([ \t]*)([%!].*|\?{1,2}[\w.*]+|[\w.*]+\?{1,2})[ \t]*$", re.MULTILINE)
+        # cell source hash -> (packages, classes, methods), least recently used first
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def _strip_magics(self, text):
+        """Replace IPython syntax with `pass`, keeping indentation and line numbers"""
+        return self._magic_pattern.sub(r'\1pass', text)
+
+    def _tokenize_symbols(self, text):
+        """Fallback for cells that are not valid python 3 (e.g. python 2 code)
+
+        Splits the cell into logical lines with the tokenizer, so imports that
+        span several lines are still seen whole, and parses only the import,
+        class and def statements.
+        """
+        collector = SymbolCollector()
+        line = []
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(text).readline):
+                if token.type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+                    if line and line[0] in ('import', 'from'):
+                        try:
+                            collector.visit(ast.parse(' '.join(line)))
+                        except SyntaxError:
+                            pass
+                    elif len(line) > 1 and line[0] == 'class':
+                        collector.classes.append(line[1])
+                    elif len(line) > 1 and line[0] == 'def':
+                        collector.methods.append(line[1])
+                    line = []
+                elif token.type not in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT):
+                    line.append(token.string)
+        except (tokenize.TokenError, IndentationError):
+            pass
+        return collector
+
+    def _cache_key(self, text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _add_to_cache(self, key, symbols):
+        self._cache[key] = symbols
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def load_symbols(self, symbols):
+        """Fill the cache with symbols from dump_symbols, e.g. kept from an earlier run"""
+        for key, (packages, classes, methods) in symbols.items():
+            self._add_to_cache(key, (packages, classes, methods))
+
+    def dump_symbols(self, texts):
+        """Return {cell hash: [packages, classes, methods]} of texts, JSON serializable"""
+        return {self._cache_key(text): list(self._extract_symbols(text)) for text in texts}
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _extract_symbols(self, text):
+        key = self._cache_key(text)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if text.lstrip().startswith('%%'):
+            # cell magic, the body is not python
+            collector = SymbolCollector()
+        else:
+            try:
+                collector = SymbolCollector()
+                collector.visit(ast.parse(self._strip_magics(text)))
+            except (SyntaxError, ValueError):
+                collector = self._tokenize_symbols(self._strip_magics(text))
+
+        symbols = (collector.packages, collector.classes, collector.methods)
+        self._add_to_cache(key, symbols)
+        return symbols
 
     def process(self,
                 text,
@@ -49,41 +125,77 @@ class SimplePython3Parser():
                 get_classes=True,
                 get_methods=False):
 
-        packages = []
-        classes = []
-        methods = []
-
-        # break to lines
-        lines = text.strip().split('\n')
-
-        for line in lines:
-            cleaned_line = line.strip().lstrip()
-
-            if get_packages:
-                packages += self.match_import(cleaned_line)
+        packages, classes, methods = self._extract_symbols(text)
 
-            if get_classes:
-                classes += self.match_class(cleaned_line)
-
-        return (packages, classes, methods)
+        return (list(packages) if get_packages else [],
+                list(classes) if get_classes else [],
+                list(methods) if get_methods else [])
 
     def test_match_import(self):
         test = """
                 import sys, os\n
                 import datetime"""
-
-        res = self.match_import(test)
-        assert res == ['sys', 'os', 'datetime']
+        res = self.process(test.strip())
+        assert res[0] == ['sys', 'os', 'datetime']
 
         test = "import datetime\n"
-        res = self.match_import(test)
-        assert res == ['datetime']
+        res = self.process(test)
+        assert res[0] == ['datetime']
 
         test = 'from datetime import datetime\n'
-        res = self.match_import(test)
-        assert res == ['datetime.datetime']
+        res = self.process(test)
+        assert res[0] == ['datetime.datetime']
+
+        # aliases and relative imports
+        test = 'import numpy as np\nfrom os import path as p, sep\nfrom . import utils\nfrom ..a.b import c'
+        res = self.process(test)
+        assert res[0] == ['numpy', 'os.path', 'os.sep', '.utils', '..a.b.c']
+
+        # imports over several lines
+        test = 'from collections import (OrderedDict,\n                         namedtuple)\nimport os, \\\n    sys'
+        res = self.process(test)
+        assert res[0] == ['collections.OrderedDict', 'collections.namedtuple', 'os', 'sys']
 
     def test_match_class(self):
         test = 'class Test:\n'
-        res = self.match_import(test)
-        assert res == ['Test']
+        res = self.process(test)
+        assert res[1] == ['Test']
+
+        test = 'class Outer(object):\n    class Inner:\n        def method(self):\n            pass\n'
+        res = self.process(test, get_methods=True)
+        assert res == ([], ['Outer', 'Inner'], ['method'])
+
+    def test_magics(self):
+        test = '%matplotlib inline\nimport numpy\n!pip install torch\nnumpy.array?\n'
+        res = self.process(test)
+        assert res[0] == ['numpy']
+
+        # the body of a cell magic is not python
+        test = '%%bash\nimport fake\n'
+        res = self.process(test)
+        assert res[0] == []
+
+        # only help lookups are magics, not any line ending with a question mark
+        test = '?numpy.array\nnumpy.*load*??\nvalues = [1,\n          2]  # enough?\nimport json\n'
+        res = self.process(test)
+        assert res[0] == ['json']
+
+    def test_cache(self):
+        parser = self.__class__(cache_size=2)
+        texts = ['import os', 'import sys', 'class A:\n    pass']
+        symbols = parser.dump_symbols(texts)
+        assert len(parser._cache) == 2
+        assert parser._cache_key(texts[0]) not in parser._cache
+
+        # symbols kept from another run are used without parsing the cells again
+        parser = self.__class__()
+        parser.load_symbols({key: [['cached'], [], []] for key in symbols})
+        assert parser.process(texts[0]) == (['cached'], [], [])
+        parser.clear_cache()
+        assert parser.process(texts[0]) == (['os'], [], [])
+        assert parser.dump_symbols(texts) == symbols
+
+    def test_python2(self):
+        test = 'import urllib2\nfrom StringIO import (StringIO,\n    BytesIO)\nprint "done"\nclass Old:\n    pass\n'
+        res = self.process(test)
+        assert res == (['urllib2', 'StringIO.StringIO', 'StringIO.BytesIO'], ['Old'], [])
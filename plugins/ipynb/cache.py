@@ -0,0 +1,104 @@
+"""
+On disk cache of rendered notebooks so unchanged notebooks are not converted again
+"""
+from __future__ import absolute_import, print_function, division
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Bump whenever the plugin renders notebooks differently
+CACHE_VERSION = 6
+
+# Settings that change the rendered content or summary
+CACHE_SETTINGS = ('IPYNB_IGNORE_CSS', 'IPYNB_USE_META_SUMMARY', 'IPYNB_STOP_SUMMARY_TAGS',
+                  'IPYNB_EXTEND_STOP_SUMMARY_TAGS', 'SUMMARY_MAX_LENGTH',
+                  'IPYNB_CSS_FILE', 'IPYNB_CSS_URL', 'IPYNB_MATHJAX_FILE', 'IPYNB_MATHJAX_URL',
+                  'IPYNB_EXTRACT_OUTPUTS', 'IPYNB_EXTRACT_OUTPUTS_URL', 'IPYNB_MAX_TEXT_OUTPUT',
+                  'SITEURL')
+
+
+class RenderCache(object):
+    """
+    Pickled render results stored by key in a directory
+
+    The total size of the directory is kept under `max_size` bytes by removing
+    the least recently used entries (entries are touched when they are read).
+    """
+    suffix = '.pickle'
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.get('IPYNB_CACHE', True):
+            return None
+        path = settings.get('IPYNB_CACHE_PATH',
+                            os.path.join(settings.get('CACHE_PATH', 'cache'), 'ipynb'))
+        return cls(path, settings.get('IPYNB_CACHE_MAX_SIZE', 100 * 1024 * 1024))
+
+    @staticmethod
+    def key(data, settings, *extra):
+        """Key of a notebook given its raw bytes and the pelican settings"""
+        key = hashlib.sha1(data)
+        relevant = [(name, settings.get(name)) for name in CACHE_SETTINGS]
+        # Pelican uses the presence of the setting, not its value
+        relevant.append(('summary', 'summary' in [name.lower() for name in settings.keys()]))
+        key.update(repr((CACHE_VERSION, relevant, extra)).encode('utf-8'))
+        return key.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as inp:
+                value = pickle.load(inp)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outp:
+            pickle.dump(value, outp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self._entry_path(key))
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(self._entry_path(key))
+        if self._size > self.max_size:
+            self._evict()
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if name.endswith(self.suffix):
+                stat = os.stat(os.path.join(self.path, name))
+                yield name, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for name, size, _ in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            self._size -= size
@@ -1,53 +1,27 @@
 """
 Core module that handles the conversion from notebook to HTML plus some utilities
+
+IPython, nbconvert and pygments are only imported when the first notebook is
+rendered (see `exporter.py`) so Pelican starts fast when no notebook changed.
 """
 from __future__ import absolute_import, print_function, division
 
+import datetime
+import hashlib
+import io
+import logging
+import os
 import re
 
-import IPython
-try:
-    # Jupyter
-    from traitlets.config import Config
-    from traitlets import Integer
-except ImportError:
-    # IPython < 4.0
-    from IPython.config import Config
-    from IPython.utils.traitlets import Integer
-
-try:
-    # Jupyter
-    from nbconvert.preprocessors import Preprocessor
-except ImportError:
-    # IPython < 4.0
-    from IPython.nbconvert.preprocessors import Preprocessor
-
-try:
-    # Jupyter
-    import nbconvert
-except ImportError:
-    # IPython < 4.0
-    import IPython.nbconvert as nbconvert
-
-from nbconvert.exporters import HTMLExporter
-try:
-    from nbconvert.filters.highlight import _pygment_highlight
-except ImportError:
-    # IPython < 2.0
-    from nbconvert.filters.highlight import _pygments_highlight
-
-try:
-    from bs4 import BeautifulSoup
-except:
-    BeautifulSoup = None
-
-from pygments.formatters import HtmlFormatter
-
-from copy import deepcopy
-
-
-LATEX_CUSTOM_SCRIPT = """
-<script type="text/javascript">if (!document.getElementById('mathjaxscript_pelican_#%@#$@#')) {
+from copy import copy
+
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+# Loads MathJax once per page, it can be inlined or served as a static file
+MATHJAX_LOADER_SCRIPT = """if (!document.getElementById('mathjaxscript_pelican_#%@#$@#')) {
     var mathjaxscript = document.createElement('script');
     mathjaxscript.id = 'mathjaxscript_pelican_#%@#$@#';
     mathjaxscript.type = 'text/javascript';
@@ -74,41 +48,160 @@ LATEX_CUSTOM_SCRIPT = """
         "}); ";
     (document.body || document.getElementsByTagName('head')[0]).appendChild(mathjaxscript);
 }
-</script>
 """
 
+LATEX_CUSTOM_SCRIPT = '\n<script type="text/javascript">' + MATHJAX_LOADER_SCRIPT + '</script>\n'
+
+# Math that MathJax (tex2jax and mml2jax) would typeset
+MATH_PATTERN = re.compile(r'\$.+?\$|\\\(|\\\[|\\begin\{|<math', re.DOTALL)
+
+
+# Exporters are expensive to build (config, templates), keep a shared one
+_exporter = None
+
+
+def get_exporter():
+    """Return the shared HTMLExporter"""
+    global _exporter
+    if _exporter is None:
+        from .exporter import Config, HTMLExporter, IgnoreCells, ExtractOutputs
+        config = Config({'CSSHTMLHeaderTransformer': {'enabled': True,
+                         'highlight_class': '.highlight-ipynb'}})
+        _exporter = HTMLExporter(config=config, template_file='basic',
+                                 filters={'highlight2html': custom_highlighter},
+                                 preprocessors=[IgnoreCells, ExtractOutputs])
+    return _exporter
+
 
-def get_html_from_filepath(filepath, start=0, end=None):
+def __getattr__(name):
+    # The preprocessors used to be defined here
+    if name in ('SliceIndex', 'SubCell', 'IgnoreCells', 'ExtractOutputs'):
+        from . import exporter
+        return getattr(exporter, name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+# Parsed notebooks by path, shared by all the liquid tags of a build
+_notebooks = {}
+
+
+def read_notebook(filepath, cache=False):
+    """Read a notebook as nbformat 4
+    With `cache` the parsed notebook is kept (until the file changes or
+    `clear_notebook_cache` is called), it must not be modified.
+    """
+    if cache:
+        stat = os.stat(filepath)
+        key = os.path.abspath(filepath)
+        cached = _notebooks.get(key)
+        if cached is not None and cached[0] == (stat.st_mtime, stat.st_size):
+            return cached[1]
+    from .exporter import nbformat
+    with io.open(filepath, encoding='utf-8') as f:
+        nb = nbformat.read(f, as_version=4)
+    if cache:
+        _notebooks[key] = ((stat.st_mtime, stat.st_size), nb)
+    return nb
+
+
+def clear_notebook_cache(*args):
+    _notebooks.clear()
+
+
+def slice_notebook(nb, start=0, end=None):
+    """Notebook with only the cells[start:end]
+    The notebook node is copied shallowly, cells are shared with `nb`.
+    """
+    if start == 0 and end is None:
+        return nb
+    nbc = copy(nb)
+    nbc.cells = nb.cells[start:end]
+    return nbc
+
+
+def notebook_from_json(nb_json):
+    """Same as `nbformat.reads(..., as_version=4)` for an already parsed JSON notebook"""
+    from .exporter import nbformat
+    major, minor = nbformat.reader.get_version(nb_json)
+    nb = nbformat.versions[major].to_notebook_json(nb_json, minor=minor)
+    nb = nbformat.convert(nb, 4)
+    try:
+        nbformat.validate(nb)
+    except nbformat.ValidationError as e:
+        # logged like nbformat.reads does, through pelican's log handler
+        logger.error('Notebook JSON is invalid: %s', e)
+    return nb
+
+
+def get_html_from_filepath(filepath, start=0, end=None, cache=False):
     """Convert ipython notebook to html
     Return: html content of the converted notebook
     """
-    config = Config({'CSSHTMLHeaderTransformer': {'enabled': True,
-                     'highlight_class': '.highlight-ipynb'},
-                     'SubCell': {'enabled':True, 'start':start, 'end':end}})
-    exporter = HTMLExporter(config=config, template_file='basic',
-                            filters={'highlight2html': custom_highlighter},
-                            preprocessors=[SubCell])
-    content, info = exporter.from_filename(filepath)
-
-    if BeautifulSoup:
-        soup = BeautifulSoup(content, 'html.parser')
-        for i in soup.findAll('div', {'class': 'input'}):
-            if i.findChildren()[1].find(text='#ignore') is not None:
-                i.extract()
-        content = soup.decode(formatter=None)
+    return get_html_from_notebook(read_notebook(filepath, cache=cache), filepath, start, end)
+
+
+def get_html_from_notebook(nb, filepath, start=0, end=None, outputs_url=None, max_text_length=None):
+    """Convert an already read notebook (nbformat 4) of `filepath` to html
+    With `outputs_url` images and the end of text outputs longer than
+    `max_text_length` are moved to files, returned in `info['ipynb_outputs']['files']`
+    to be served from `outputs_url`.
+    Return: html content of the converted notebook
+    """
+    path, basename = os.path.split(filepath)
+    modified_date = datetime.datetime.fromtimestamp(os.path.getmtime(filepath))
+    resources = {'metadata': {'name': os.path.splitext(basename)[0],
+                              'path': path,
+                              'modified_date': modified_date.strftime('%B %d, %Y')}}
+    if outputs_url:
+        resources['ipynb_outputs'] = {'url': outputs_url, 'max_text_length': max_text_length, 'files': {}}
+    # The exporter deep copies the notebook it is given, slice it first so
+    # only the selected cells are copied
+    nb = slice_notebook(nb, start, end)
 
+    exporter = get_exporter()
+    # HTMLExporter uses self.filters['highlight_code'] if present
+    # instead of building a new highlighter for every notebook
+    langinfo = nb.metadata.get('language_info', {})
+    exporter.filters['highlight_code'] = get_highlighter(
+        langinfo.get('pygments_lexer', langinfo.get('name', None)))
+    content, info = exporter.from_notebook_node(nb, resources)
+    info['has_math'] = has_math(nb)
+    if outputs_url:
+        # Extracted images are loaded when they are scrolled to
+        content = content.replace('<img src="{0}/'.format(outputs_url),
+                                  '<img loading="lazy" src="{0}/'.format(outputs_url))
     return content, info
 
 
-def fix_css(content, info, ignore_css=False):
+def has_math(nb):
+    """True if MathJax has anything to typeset in the notebook"""
+    for cell in nb.cells:
+        if cell.cell_type == 'markdown' and MATH_PATTERN.search(cell.source):
+            return True
+        for output in cell.get('outputs', []):
+            data = output.get('data', {})
+            if 'text/latex' in data:
+                return True
+            for mimetype in ('text/html', 'text/markdown'):
+                if mimetype in data and MATH_PATTERN.search(data[mimetype]):
+                    return True
+    return False
+
+
+# Filtered notebook CSS by hash of the original stylesheet, it is the same
+# stylesheet for every notebook of a build
+_filtered_css = {}
+_css_color_pattern = re.compile(r'color\:\#0+(;)?')
+_css_rendered_html_pattern = re.compile(r'\.rendered_html[a-z0-9,._ ]*\{[a-z0-9:;%.#\-\s\n]+\}')
+
+
+def filter_css(style_text):
     """
-    General fixes for the notebook generated html
+    HACK: IPython returns a lot of CSS including its own bootstrap.
+    Get only the IPython Notebook CSS styles.
     """
-    def filter_css(style_text):
-        """
-        HACK: IPython returns a lot of CSS including its own bootstrap.
-        Get only the IPython Notebook CSS styles.
-        """
+    key = hashlib.sha1(style_text.encode('utf-8')).hexdigest()
+    if key not in _filtered_css:
         index = style_text.find('/*!\n*\n* IPython notebook\n*\n*/')
         if index > 0:
             style_text = style_text[index:]
@@ -116,18 +209,165 @@ def fix_css(content, info, ignore_css=False):
         if index > 0:
             style_text = style_text[:index]
 
-        style_text = re.sub(r'color\:\#0+(;)?', '', style_text)
-        style_text = re.sub(r'\.rendered_html[a-z0-9,._ ]*\{[a-z0-9:;%.#\-\s\n]+\}', '', style_text)
-        return '<style type=\"text/css\">{0}</style>'.format(style_text)
+        style_text = _css_color_pattern.sub('', style_text)
+        style_text = _css_rendered_html_pattern.sub('', style_text)
+        _filtered_css[key] = style_text
+    return _filtered_css[key]
+
+
+def fix_css(content, info, ignore_css=False, css_url=None, mathjax_url=None):
+    """
+    General fixes for the notebook generated html
+    With `css_url` the notebook CSS is linked (see `write_css`) instead of inlined
+    and with `mathjax_url` the MathJax loader (see `write_mathjax`).
+    The MathJax loader is left out for notebooks without math.
+    """
+    if not info.get('has_math', True):
+        mathjax_script = ''
+    elif mathjax_url:
+        mathjax_script = '\n<script type="text/javascript" src="{0}"></script>\n'.format(mathjax_url)
+    else:
+        mathjax_script = LATEX_CUSTOM_SCRIPT
 
     if ignore_css:
-        content = content + LATEX_CUSTOM_SCRIPT
+        content = content + mathjax_script
+    elif css_url:
+        ipython_css = '<link rel="stylesheet" type="text/css" href="{0}">'.format(css_url)
+        content = ipython_css + content + mathjax_script
     else:
-        ipython_css = '\n'.join(filter_css(css_style) for css_style in info['inlining']['css'])
-        content = ipython_css + content + LATEX_CUSTOM_SCRIPT
+        ipython_css = '\n'.join('<style type=\"text/css\">{0}</style>'.format(filter_css(css_style))
+                                 for css_style in info['inlining']['css'])
+        content = ipython_css + content + mathjax_script
     return content
 
 
+def get_css():
+    """The filtered notebook CSS the exporter inlines in every notebook"""
+    from .exporter import nbformat
+    _, info = get_exporter().from_notebook_node(nbformat.v4.new_notebook())
+    return '\n'.join(filter_css(css_style) for css_style in info['inlining']['css'])
+
+
+def write_asset(filepath, text):
+    """Write a static file shared by the notebooks, only if its content changed"""
+    if os.path.exists(filepath):
+        with io.open(filepath, encoding='utf-8') as f:
+            if f.read() == text:
+                return
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    with io.open(filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def write_css(filepath):
+    """Write the shared notebook stylesheet"""
+    write_asset(filepath, get_css())
+
+
+def write_mathjax(filepath):
+    """Write the shared MathJax loader script"""
+    write_asset(filepath, MATHJAX_LOADER_SCRIPT)
+
+
+def asset_urls(get_setting):
+    """
+    URLs of the shared stylesheet and MathJax loader, None for the ones that are inlined
+    `get_setting(name, default)` reads the Pelican settings or the liquid tag configs
+    """
+    site_url = get_setting('SITEURL', '') or ''
+    urls = []
+    for prefix in ('IPYNB_CSS', 'IPYNB_MATHJAX'):
+        path = get_setting(prefix + '_FILE', None)
+        urls.append((get_setting(prefix + '_URL', None) or '{0}/{1}'.format(site_url, path)) if path else None)
+    return tuple(urls)
+
+
+def add_static_files(pelican):
+    """
+    Write the shared notebook stylesheet and MathJax loader when
+    `IPYNB_CSS_FILE` and `IPYNB_MATHJAX_FILE` are set
+    """
+    if pelican.settings.get('IPYNB_CSS_FILE'):
+        write_css(os.path.join(pelican.settings['OUTPUT_PATH'], pelican.settings['IPYNB_CSS_FILE']))
+    if pelican.settings.get('IPYNB_MATHJAX_FILE'):
+        write_mathjax(os.path.join(pelican.settings['OUTPUT_PATH'], pelican.settings['IPYNB_MATHJAX_FILE']))
+
+
+_formatters = {}
+_lexers = {}
+
+
+def get_formatter(cssclass):
+    """Return a shared pygments HtmlFormatter for the css class"""
+    if cssclass not in _formatters:
+        from pygments.formatters import HtmlFormatter
+        _formatters[cssclass] = HtmlFormatter(cssclass=cssclass)
+    return _formatters[cssclass]
+
+
+def get_lexer(language):
+    """
+    Return a shared pygments lexer for the language,
+    same lookup as nbconvert `_pygments_highlight`
+    """
+    if language not in _lexers:
+        lexer = None
+        if language in ('ipython2', 'ipython3'):
+            try:
+                from IPython.lib.lexers import IPythonLexer, IPython3Lexer
+            except ImportError:
+                pass
+            else:
+                lexer = IPythonLexer() if language == 'ipython2' else IPython3Lexer()
+        if lexer is None:
+            from pygments.lexers import get_lexer_by_name
+            from pygments.lexers.special import TextLexer
+            from pygments.util import ClassNotFound
+            name = {'ipython2': 'python', 'ipython3': 'python3'}.get(language, language)
+            try:
+                lexer = get_lexer_by_name(name, stripall=True)
+            except ClassNotFound:
+                lexer = TextLexer()
+        _lexers[language] = lexer
+    return _lexers[language]
+
+
+def pygments_highlight(source, formatter, language, metadata=None):
+    # If the cell uses a magic extension language, use it instead
+    if language.startswith('ipython') and metadata and 'magics_language' in metadata:
+        language = metadata['magics_language']
+    from pygments import highlight
+    return highlight(source, get_lexer(language), formatter)
+
+
+class CachedHighlighter(object):
+    """
+    Same output as nbconvert `Highlight2HTML` filter (`highlight_code`)
+    but reusing formatters and lexers between cells and notebooks
+    """
+    def __init__(self, pygments_lexer=None):
+        self.pygments_lexer = pygments_lexer or 'ipython3'
+
+    def __call__(self, source, language=None, metadata=None):
+        if not language:
+            language = self.pygments_lexer
+        with tracer.span('highlight', bytes=len(source)):
+            return pygments_highlight(source if len(source) > 0 else ' ',
+                                      get_formatter(' highlight hl-' + language),
+                                      language, metadata)
+
+
+_highlighters = {}
+
+
+def get_highlighter(pygments_lexer):
+    """Return the shared `highlight_code` filter for a notebook language"""
+    if pygments_lexer not in _highlighters:
+        _highlighters[pygments_lexer] = CachedHighlighter(pygments_lexer)
+    return _highlighters[pygments_lexer]
+
+
 def custom_highlighter(source, language='python', metadata=None):
     """
     Makes the syntax highlighting from pygments have prefix(`highlight-ipynb`)
@@ -140,31 +380,6 @@ def custom_highlighter(source, language='python', metadata=None):
     if not language:
         language = 'python'
 
-    formatter = HtmlFormatter(cssclass='highlight-ipynb')
-    output = _pygments_highlight(source, formatter, language, metadata)
+    output = pygments_highlight(source, get_formatter('highlight-ipynb'), language, metadata)
     output = output.replace('<pre>', '<pre class="ipynb">')
     return output
-
-#----------------------------------------------------------------------
-# Create a preprocessor to slice notebook by cells
-
-class SliceIndex(Integer):
-    """An integer trait that accepts None"""
-    default_value = None
-
-    def validate(self, obj, value):
-        if value is None:
-            return value
-        else:
-            return super(SliceIndex, self).validate(obj, value)
-
-
-class SubCell(Preprocessor):
-    """A preprocessor to select a slice of the cells of a notebook"""
-    start = SliceIndex(0, config=True, help="first cell of notebook")
-    end = SliceIndex(None, config=True, help="last cell of notebook")
-
-    def preprocess(self, nb, resources):
-        nbc = deepcopy(nb)
-        nbc.cells = nbc.cells[self.start:self.end]
-        return nbc, resources
@@ -0,0 +1,129 @@
+"""
+Imports of IPython/Jupyter and the nbconvert preprocessors, kept out of `core.py`
+so they are only loaded when a notebook is rendered
+"""
+from __future__ import absolute_import, print_function, division
+
+import base64
+import hashlib
+import re
+
+try:
+    # Jupyter
+    from traitlets.config import Config
+    from traitlets import Integer
+except ImportError:
+    # IPython < 4.0
+    from IPython.config import Config
+    from IPython.utils.traitlets import Integer
+
+try:
+    # Jupyter
+    from nbconvert.preprocessors import Preprocessor
+    from nbconvert.exporters import HTMLExporter
+except ImportError:
+    # IPython < 4.0
+    from IPython.nbconvert.preprocessors import Preprocessor
+    from IPython.nbconvert.exporters import HTMLExporter
+
+try:
+    # Jupyter
+    import nbformat
+except ImportError:
+    # IPython < 4.0
+    import IPython.nbformat as nbformat
+
+from .core import slice_notebook
+from .tracing import tracer
+
+
+#----------------------------------------------------------------------
+# Create a preprocessor to slice notebook by cells
+
+class SliceIndex(Integer):
+    """An integer trait that accepts None"""
+    default_value = None
+
+    def validate(self, obj, value):
+        if value is None:
+            return value
+        else:
+            return super(SliceIndex, self).validate(obj, value)
+
+
+class SubCell(Preprocessor):
+    """A preprocessor to select a slice of the cells of a notebook"""
+    start = SliceIndex(0, config=True, help="first cell of notebook")
+    end = SliceIndex(None, config=True, help="last cell of notebook")
+
+    def preprocess(self, nb, resources):
+        return slice_notebook(nb, self.start, self.end), resources
+
+
+class IgnoreCells(Preprocessor):
+    """A preprocessor to hide the input of code cells with an `#ignore` comment
+
+    The outputs are kept, only the source is not rendered (nbconvert>=5.3)
+    """
+    ignore_pattern = re.compile(r'#ignore$', re.MULTILINE)
+
+    def preprocess(self, nb, resources):
+        with tracer.span('ignore filter'):
+            return super(IgnoreCells, self).preprocess(nb, resources)
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type == 'code' and self.ignore_pattern.search(cell.source):
+            cell.setdefault('transient', {})['remove_source'] = True
+        return cell, resources
+
+
+class ExtractOutputs(Preprocessor):
+    """A preprocessor to move image outputs and the end of long text outputs to files
+
+    Only runs when `resources['ipynb_outputs']` is set to a dict with the `url`
+    of the files and optionally `max_text_length`. The files are named by the
+    hash of their content and added to its `files` dict (name -> bytes).
+    """
+    image_extensions = {'image/png': '.png', 'image/jpeg': '.jpg'}
+
+    def preprocess(self, nb, resources):
+        if not resources.get('ipynb_outputs'):
+            return nb, resources
+        with tracer.span('extract outputs'):
+            return super(ExtractOutputs, self).preprocess(nb, resources)
+
+    def add_file(self, options, data, extension):
+        name = hashlib.sha1(data).hexdigest() + extension
+        options.setdefault('files', {})[name] = data
+        return '{0}/{1}'.format(options['url'], name)
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type != 'code':
+            return cell, resources
+        options = resources['ipynb_outputs']
+        max_length = options.get('max_text_length')
+
+        outputs = []
+        for output in cell.outputs:
+            outputs.append(output)
+            text = None
+            if output.output_type == 'stream':
+                text = output.text
+            elif output.output_type in ('display_data', 'execute_result'):
+                for mimetype, extension in self.image_extensions.items():
+                    if mimetype in output.data:
+                        url = self.add_file(options, base64.b64decode(output.data[mimetype]), extension)
+                        output.setdefault('metadata', {}).setdefault('filenames', {})[mimetype] = url
+                if list(output.data.keys()) == ['text/plain']:
+                    text = output.data['text/plain']
+
+            if max_length and text is not None and len(text) > max_length:
+                url = self.add_file(options, text.encode('utf-8'), '.txt')
+                if output.output_type == 'stream':
+                    output.text = text[:max_length]
+                else:
+                    output.data['text/plain'] = text[:max_length]
+                link = '<a href="{0}">Output truncated, show all {1} characters</a>'.format(url, len(text))
+                outputs.append(nbformat.v4.new_output('display_data', data={'text/html': link}))
+        cell.outputs = outputs
+        return cell, resources
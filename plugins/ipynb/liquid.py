@@ -3,9 +3,10 @@ from __future__ import absolute_import, print_function, unicode_literals
 import os
 import re
 
+from pelican import signals
 from liquid_tags.mdx_liquid_tags import LiquidTags
 
-from .core import get_html_from_filepath, fix_css
+from .core import get_html_from_filepath, fix_css, clear_notebook_cache, asset_urls, add_static_files
 
 
 SYNTAX = "{% notebook ~/absolute/path/to/notebook.ipynb [cells[start:end]] %}"
@@ -34,13 +35,20 @@ def notebook(preprocessor, tag, markup):
 
     # nb_dir =  preprocessor.configs.getConfig('NOTEBOOK_DIR')
     nb_path = os.path.join('content', src)
-    content, info = get_html_from_filepath(nb_path, start=start, end=end)
+    # Tags on the same notebook share one parsed notebook during the build
+    content, info = get_html_from_filepath(nb_path, start=start, end=end, cache=True)
     ignore_css = preprocessor.configs.getConfig('IPYNB_IGNORE_CSS', False)
-    content = fix_css(content, info, ignore_css=ignore_css)
+    css_url, mathjax_url = asset_urls(preprocessor.configs.getConfig)
+    content = fix_css(content, info, ignore_css=ignore_css, css_url=css_url, mathjax_url=mathjax_url)
     content = preprocessor.configs.htmlStash.store(content, safe=True)
     return content
 
 
+signals.finalized.connect(clear_notebook_cache)
+# same receiver as ipynb.markup, it runs once when both are enabled
+signals.finalized.connect(add_static_files)
+
+
 # ---------------------------------------------------
 # This import allows notebook tag to be a Pelican plugin
 from liquid_tags import register  # noqa
@@ -1,7 +1,9 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
+import fnmatch
 import os
 import json
+import multiprocessing
 import six
 
 try:
@@ -14,7 +16,9 @@ except ImportError:
 from pelican import signals
 from pelican.readers import MarkdownReader, HTMLReader, BaseReader
 
-from .ipynb import get_html_from_filepath, fix_css
+from .cache import RenderCache, CACHE_SETTINGS
+from .tracing import tracer
+from .ipynb import get_html_from_notebook, notebook_from_json, fix_css, asset_urls, add_static_files
 
 
 def register():
@@ -23,7 +27,107 @@ def register():
     """
     def add_reader(arg):
         arg.settings["READERS"]["ipynb"] = IPythonNB
+    signals.initialized.connect(start_profiling)
     signals.initialized.connect(add_reader)
+    signals.initialized.connect(prerender_notebooks)
+    signals.finalized.connect(add_static_files)
+    signals.finalized.connect(stop_prerendering)
+    signals.finalized.connect(stop_profiling)
+
+
+def start_profiling(pelican):
+    if pelican.settings.get('IPYNB_PROFILE'):
+        tracer.enable()
+
+
+def stop_profiling(pelican):
+    """
+    Print where the notebooks rendering time went and write the Chrome trace
+    if `IPYNB_PROFILE` is a file path
+    """
+    profile = pelican.settings.get('IPYNB_PROFILE')
+    if profile:
+        print(tracer.summary())
+        if profile is not True:
+            tracer.save(profile)
+
+
+# Notebooks rendered ahead of `IPythonNB.read` by the worker pool, by absolute path
+_prerendering = {}
+_pool = None
+
+
+def prerender_notebooks(pelican):
+    """
+    Render the notebooks under `PATH` in `IPYNB_RENDER_WORKERS` processes
+    (0 for one per CPU) while Pelican reads the rest of the content
+    """
+    global _pool
+    settings = pelican.settings
+    workers = settings.get('IPYNB_RENDER_WORKERS', 1)
+    if workers == 1:
+        return
+
+    ignore = settings.get('IGNORE_FILES', [])
+    filepaths = []
+    for root, dirs, files in os.walk(settings['PATH'], followlinks=True):
+        dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, pattern) for pattern in ignore)]
+        for name in sorted(files):
+            if name.endswith('.ipynb') and not any(fnmatch.fnmatch(name, pattern) for pattern in ignore):
+                filepaths.append(os.path.join(root, name))
+    if not filepaths:
+        return
+
+    # Only the settings used to render, the others may not be picklable
+    worker_settings = dict((key, value) for key, value in settings.items()
+                           if key.startswith('IPYNB_') or key in CACHE_SETTINGS or key.lower() == 'summary')
+    cache = RenderCache.from_settings(settings)
+    _pool = multiprocessing.Pool(workers or None)
+    for filepath in filepaths:
+        _prerendering[os.path.abspath(filepath)] = _pool.apply_async(prerender, (filepath, worker_settings, cache))
+    _pool.close()
+
+
+def prerender(filepath, settings, cache=None):
+    """
+    Render a notebook in a worker process
+    Return: (cache key, rendered, spans), rendered is None if `IPythonNB.read` should do it
+    """
+    if settings.get('IPYNB_PROFILE'):
+        tracer.enable()
+        # Forked workers start with the spans of the parent
+        tracer.drain()
+    key, rendered = _prerender(filepath, settings, cache)
+    return key, rendered, tracer.drain()
+
+
+def _prerender(filepath, settings, cache):
+    with open(filepath, 'rb') as ipynb_file:
+        data = ipynb_file.read()
+    key = RenderCache.key(data, settings)
+    if cache and key in cache:
+        return key, None
+    try:
+        nb_json = json.loads(data.decode('utf-8'))
+        metadata_filepath = os.path.splitext(filepath)[0] + '.ipynb-meta'
+        keys = set(k.lower() for k in nb_json['metadata'].keys())
+        if not os.path.exists(metadata_filepath) and not set(['title', 'date']).issubset(keys):
+            # Not an article, read raises
+            return key, None
+        with tracer.span('parse', file=filepath, bytes=len(data)):
+            nb = notebook_from_json(nb_json)
+        return key, IPythonNB(settings).render(filepath, os.path.basename(filepath), nb)
+    except Exception:
+        # Rendered again by read, which reports the error
+        return key, None
+
+
+def stop_prerendering(pelican):
+    global _pool
+    _prerendering.clear()
+    if _pool is not None:
+        _pool.terminate()
+        _pool = None
 
 
 class IPythonNB(BaseReader):
@@ -40,8 +144,13 @@ class IPythonNB(BaseReader):
     """
     enabled = True
     file_extensions = ['ipynb']
+    cache = None
 
     def read(self, filepath):
+        with tracer.span('read', file=filepath):
+            return self._read(filepath)
+
+    def _read(self, filepath):
         metadata = {}
         metadata['ipython'] = True
 
@@ -51,6 +160,13 @@ class IPythonNB(BaseReader):
         metadata_filename = os.path.splitext(filename)[0] + '.ipynb-meta'
         metadata_filepath = os.path.join(filedir, metadata_filename)
 
+        # The notebook is read and parsed once for the metadata, the cache and the rendering
+        with tracer.span('load', file=filepath) as span:
+            with open(filepath, 'rb') as ipynb_file:
+                data = ipynb_file.read()
+            span['bytes'] = len(data)
+        nb_json = None
+
         if os.path.exists(metadata_filepath):
             # Metadata is on a external file,
             # process using Pelican MD Reader
@@ -58,8 +174,8 @@ class IPythonNB(BaseReader):
             _content, metadata = md_reader.read(metadata_filepath)
         else:
             # Load metadata from ipython notebook file
-            ipynb_file = open(filepath)
-            notebook_metadata = json.load(ipynb_file)['metadata']
+            nb_json = json.loads(data.decode('utf-8'))
+            notebook_metadata = nb_json['metadata']
 
             # Change to standard pelican metadata
             for key, value in notebook_metadata.items():
@@ -78,28 +194,91 @@ class IPythonNB(BaseReader):
                 raise Exception("Could not find metadata in `.ipynb-meta` or inside `.ipynb` but found `.md` file, "
                       "assuming that this notebook is for liquid tag usage if true ignore this error")
 
-        content, info = get_html_from_filepath(filepath)
+        if self.cache is None:
+            self.cache = RenderCache.from_settings(self.settings) or False
+        key = RenderCache.key(data, self.settings)
+        rendered = None
+        if self.cache:
+            with tracer.span('cache get', file=filepath):
+                rendered = self.cache.get(key)
+        if rendered is None:
+            prerendering = _prerendering.pop(os.path.abspath(filepath), None)
+            if prerendering is not None:
+                with tracer.span('wait worker', file=filepath):
+                    prerendered_key, rendered, spans = prerendering.get()
+                tracer.merge(spans)
+                if prerendered_key != key:
+                    # Changed since it was rendered
+                    rendered = None
+            if rendered is None:
+                with tracer.span('parse', file=filepath, bytes=len(data)):
+                    if nb_json is None:
+                        nb_json = json.loads(data.decode('utf-8'))
+                    nb = notebook_from_json(nb_json)
+                rendered = self.render(filepath, filename, nb)
+            if self.cache:
+                with tracer.span('cache set', file=filepath):
+                    self.cache.set(key, rendered)
+
+        content, set_summary, summary, files = rendered
+        if files:
+            with tracer.span('write outputs', file=filepath, bytes=sum(len(data) for data in files.values())):
+                self.write_outputs(files)
+        if set_summary:
+            # None too (e.g. a short notebook), pelican would otherwise cut the content with its CSS
+            metadata['summary'] = summary
+        return content, metadata
+
+    def render(self, filepath, filename, nb):
+        """
+        Convert the notebook (nbformat 4) to html and create its summary
+        Return: (content, set_summary, summary, files), summary is only set in the metadata
+        if set_summary is True and files are the outputs extracted with `IPYNB_EXTRACT_OUTPUTS` (name -> bytes)
+        """
+        set_summary = False
+        summary = None
+        outputs_url = None
+        if self.settings.get('IPYNB_EXTRACT_OUTPUTS'):
+            outputs_url = self.settings.get('IPYNB_EXTRACT_OUTPUTS_URL') or \
+                '{0}/{1}'.format(self.settings.get('SITEURL', ''), self.settings['IPYNB_EXTRACT_OUTPUTS'])
+        with tracer.span('nbconvert render', file=filepath) as span:
+            content, info = get_html_from_notebook(nb, filepath, outputs_url=outputs_url,
+                                                   max_text_length=self.settings.get('IPYNB_MAX_TEXT_OUTPUT'))
+            span['bytes'] = len(content)
+        files = info['ipynb_outputs']['files'] if outputs_url else {}
 
         # Generate Summary: Do it before cleaning CSS
         if 'summary' not in [key.lower() for key in self.settings.keys()]:
             parser = MyHTMLParser(self.settings, filename)
             if isinstance(content, six.binary_type): # PY2 (str) or PY3 (bytes) to PY2 (unicode) or PY3 (str)
                 # unicode_literals makes format() try to decode as ASCII. Enforce decoding as UTF-8.
-                content = '<body>{0}</body>'.format(content.decode("utf-8"))
-            else:
-                # Content already decoded
-                content = '<body>{0}</body>'.format(content)
-            parser.feed(content)
-            parser.close()
-            content = parser.body
+                content = content.decode("utf-8")
+            # The content is kept as is, the parser stops as soon as the summary is known
+            with tracer.span('summary', file=filepath):
+                parser.feed_summary('<body>{0}</body>'.format(content))
             if ('IPYNB_USE_META_SUMMARY' in self.settings.keys() and \
               self.settings['IPYNB_USE_META_SUMMARY'] == False) or \
               'IPYNB_USE_META_SUMMARY' not in self.settings.keys():
-                metadata['summary'] = parser.summary
+                set_summary = True
+                summary = parser.summary
 
         ignore_css = True if 'IPYNB_IGNORE_CSS' in self.settings.keys() else False
-        content = fix_css(content, info, ignore_css=ignore_css)
-        return content, metadata
+        css_url, mathjax_url = asset_urls(self.settings.get)
+        content = fix_css(content, info, ignore_css=ignore_css, css_url=css_url, mathjax_url=mathjax_url)
+        return content, set_summary, summary, files
+
+    def write_outputs(self, files):
+        """
+        Write the extracted outputs, files are named by their content so existing ones are kept
+        """
+        outputs_path = os.path.join(self.settings['OUTPUT_PATH'], self.settings['IPYNB_EXTRACT_OUTPUTS'])
+        if not os.path.isdir(outputs_path):
+            os.makedirs(outputs_path)
+        for name, data in files.items():
+            filepath = os.path.join(outputs_path, name)
+            if not os.path.exists(filepath):
+                with open(filepath, 'wb') as outp:
+                    outp.write(data)
 
 
 class MyHTMLParser(HTMLReader._HTMLParser):
@@ -113,36 +292,67 @@ class MyHTMLParser(HTMLReader._HTMLParser):
     The downside is that the summary length is not exactly the specified, it stops at
     completed div/p/li/etc tags.
     """
+    chunk_size = 16 * 1024
+
     def __init__(self, settings, filename):
         HTMLReader._HTMLParser.__init__(self, settings, filename)
         self.settings = settings
         self.filename = filename
         self.wordcount = 0
         self.summary = None
+        # Spaces in the text seen so far, the words are the text split by spaces
+        self.spaces = 0
 
         self.stop_tags = [('div', ('class', 'input')), ('div', ('class', 'output')), ('h2', ('id', 'Header-2'))]
         if 'IPYNB_STOP_SUMMARY_TAGS' in self.settings.keys():
-            self.stop_tags = self.settings['IPYNB_STOP_SUMMARY_TAGS']
+            self.stop_tags = list(self.settings['IPYNB_STOP_SUMMARY_TAGS'])
         if 'IPYNB_EXTEND_STOP_SUMMARY_TAGS' in self.settings.keys():
             self.stop_tags.extend(self.settings['IPYNB_EXTEND_STOP_SUMMARY_TAGS'])
 
+        # tag -> attributes that stop the summary (None for any attributes)
+        self.stop_attrs = {}
+        for stoptag in self.stop_tags:
+            self.stop_attrs.setdefault(stoptag[0], []).append(stoptag[1])
+
+    def summary_done(self):
+        return self.wordcount >= self.settings['SUMMARY_MAX_LENGTH']
+
+    def feed_summary(self, content):
+        """
+        Feed the content until the summary is known
+        """
+        for index in range(0, len(content), self.chunk_size):
+            self.feed(content[index:index + self.chunk_size])
+            if self.summary_done():
+                return
+        self.close()
+
     def handle_starttag(self, tag, attrs):
         HTMLReader._HTMLParser.handle_starttag(self, tag, attrs)
 
-        if self.wordcount < self.settings['SUMMARY_MAX_LENGTH']:
-            mask = [stoptag[0] == tag and (stoptag[1] is None or stoptag[1] in attrs) for stoptag in self.stop_tags]
-            if any(mask):
+        if not self.summary_done() and tag in self.stop_attrs:
+            if any(stopattr is None or stopattr in attrs for stopattr in self.stop_attrs[tag]):
                 self.summary = self._data_buffer
                 self.wordcount = self.settings['SUMMARY_MAX_LENGTH']
 
     def handle_endtag(self, tag):
         HTMLReader._HTMLParser.handle_endtag(self, tag)
 
-        if self.wordcount < self.settings['SUMMARY_MAX_LENGTH']:
-            self.wordcount = len(strip_tags(self._data_buffer).split(' '))
-            if self.wordcount >= self.settings['SUMMARY_MAX_LENGTH']:
+        if not self.summary_done():
+            self.wordcount = self.spaces + 1
+            if self.summary_done():
                 self.summary = self._data_buffer
 
+    def handle_data(self, data):
+        HTMLReader._HTMLParser.handle_data(self, data)
+        if self._in_body:
+            self.spaces += data.count(' ')
+
+    def handle_charref(self, data):
+        HTMLReader._HTMLParser.handle_charref(self, data)
+        if self._in_body and data.lower() in ('32', 'x20'):
+            self.spaces += 1
+
 
 def strip_tags(html):
     """
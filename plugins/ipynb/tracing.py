@@ -0,0 +1,92 @@
+"""
+Lightweight timing spans for the notebook pipeline (publish.py and the ipynb plugin)
+
+Spans are only recorded once the tracer is enabled, they can be exported as a
+Chrome trace (chrome://tracing, Perfetto) or printed as a summary table.
+
+    with tracer.span('nbconvert render', file=filepath, bytes=len(data)):
+        ...
+"""
+from __future__ import absolute_import, print_function, division
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    # Python 2
+    clock = time.time
+
+
+class Tracer(object):
+    """
+    Records `(name, start, duration, pid, tid, args)` spans, times in seconds
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time the block, `args` (e.g. `file`, `bytes`) are kept with the span"""
+        if not self.enabled:
+            yield args
+            return
+        start = clock()
+        try:
+            yield args
+        finally:
+            self.events.append((name, start, clock() - start, os.getpid(),
+                                threading.current_thread().ident, args))
+
+    def drain(self):
+        """Return and forget the recorded spans, to send them from a worker process"""
+        events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        """Add spans recorded by a worker process"""
+        self.events.extend(events)
+
+    def to_chrome_trace(self):
+        return {'traceEvents': [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                                 'pid': pid, 'tid': tid, 'args': args}
+                                for name, start, duration, pid, tid, args in self.events]}
+
+    def save(self, file_path):
+        with open(file_path, 'w') as outp:
+            json.dump(self.to_chrome_trace(), outp)
+
+    def summary(self, slowest=10):
+        """Table of the total time per span name and of the slowest spans by file"""
+        totals = {}
+        for name, _, duration, _, _, args in self.events:
+            total = totals.setdefault(name, [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            total[3] += args.get('bytes', 0)
+
+        lines = ['{:<24} {:>7} {:>10} {:>10} {:>12}'.format('span', 'count', 'total ms', 'max ms', 'bytes')]
+        for name, (count, duration, longest, size) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<24} {:>7} {:>10.1f} {:>10.1f} {:>12}'.format(
+                name, count, duration * 1e3, longest * 1e3, size))
+
+        by_file = sorted((event for event in self.events if 'file' in event[5]), key=lambda event: -event[2])
+        if by_file:
+            lines.append('')
+            lines.append('slowest by file:')
+            for name, _, duration, _, _, args in by_file[:slowest]:
+                lines.append('{:>10.1f} ms  {:<24} {}'.format(duration * 1e3, name, args['file']))
+        return '\n'.join(lines)
+
+
+tracer = Tracer()
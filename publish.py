@@ -1,15 +1,168 @@
+import argparse
+import io
 import json
 import glob
+import hashlib
 import os.path
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
 from datetime import datetime
 from textwrap import dedent
-import nbformat
 
 from parsers.markdown_parser import SimpleMarkdownParser
+from parsers.notebook_parser import SimpleNotebookParser
 from parsers.python3_parser import SimplePython3Parser
+from plugins.ipynb.tracing import tracer
 
 from collections import namedtuple
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+NotebookTask = namedtuple('NotebookTask', ['file_name', 'file_path', 'date', 'modified', 'file_hash'])
+
+_worker_publisher = None
+
+
+@contextmanager
+def atomic_open(file_path, mode='w'):
+    """Open a temporary file next to file_path and move it in place once written"""
+    tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    try:
+        with open(tmp_path, mode) as outp:
+            yield outp
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def copy_file(src, dst, hardlink=False):
+    """Atomically replace dst with the bytes of src, hard linking when asked to"""
+    tmp_path = '{}.{}.tmp'.format(dst, os.getpid())
+    try:
+        if hardlink:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                # cross-device or unsupported filesystem
+                shutil.copyfile(src, tmp_path)
+        else:
+            # copyfile uses sendfile on Linux, the bytes never go through python
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class NotebookWatcher():
+    """Collect the notebooks of a directory that changed
+
+    Uses filesystem events (inotify and friends through watchdog) when it is
+    installed and polls the directory otherwise.
+    """
+
+    def __init__(self, path, suffix, poll_interval=0.5, use_events=True):
+        self.path = path
+        self.suffix = '.' + suffix
+        self.poll_interval = poll_interval
+        self.use_events = use_events and Observer is not None
+        self.changed = set()
+        self.last_change = 0
+        self.condition = threading.Condition()
+        self._observer = None
+        self._stopped = threading.Event()
+
+    def _is_notebook(self, file_path):
+        name = os.path.basename(file_path)
+        # skip hidden files like the `.~name.ipynb` temporary files of Jupyter
+        return (name.endswith(self.suffix) and not name.startswith('.')
+                and os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(self.path))
+
+    def notify(self, file_path):
+        if self._is_notebook(file_path):
+            with self.condition:
+                self.changed.add(os.path.join(self.path, os.path.basename(file_path)))
+                self.last_change = time.time()
+                self.condition.notify()
+
+    def _scan(self):
+        snapshot = {}
+        for entry in os.scandir(self.path):
+            if entry.is_file() and self._is_notebook(entry.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # deleted since it was listed
+                    continue
+                snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _poll(self):
+        snapshot = self._scan()
+        while not self._stopped.wait(self.poll_interval):
+            current = self._scan()
+            for name, state in current.items():
+                if snapshot.get(name) != state:
+                    self.notify(os.path.join(self.path, name))
+            snapshot = current
+
+    def start(self):
+        if self.use_events:
+            self._observer = Observer()
+            self._observer.schedule(_NotebookEventHandler(self), self.path, recursive=False)
+            self._observer.start()
+        else:
+            threading.Thread(target=self._poll, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def wait(self, debounce=0.2):
+        """Block until notebooks changed and no other change came for `debounce` seconds"""
+        with self.condition:
+            while True:
+                if self.changed:
+                    quiet = time.time() - self.last_change
+                    if quiet >= debounce:
+                        changed, self.changed = self.changed, set()
+                        return changed
+                    self.condition.wait(debounce - quiet)
+                else:
+                    self.condition.wait()
+
+
+class _NotebookEventHandler(FileSystemEventHandler):
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    # reading a notebook emits opened and closed events, only writes matter
+    event_types = ('created', 'modified', 'moved', 'closed')
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in self.event_types:
+            return
+        self.watcher.notify(event.src_path)
+        # Jupyter saves to a temporary file and moves it over the notebook
+        if getattr(event, 'dest_path', None):
+            self.watcher.notify(event.dest_path)
+
 
 class Meta():
     def __init__(self,
@@ -91,11 +244,364 @@ class Meta():
         return markdown_string
 
     def dump_markdown_file(self, file_path):
-        with open(file_path, 'w') as outp:
+        with atomic_open(file_path) as outp:
             data = self.dump_markdown_string()
             outp.write(data)
 
 
+class BuildManifest():
+    """Persistent record of what was published for every notebook
+
+    Each entry keeps the hash of the raw notebook file, a hash of its cells,
+    the nbformat version, the parser versions and the output paths, so that
+    unchanged notebooks can be skipped without parsing them. The symbols found
+    in its code cells are kept by cell hash, to parse only the edited cells
+    when the notebook changes.
+    """
+    version = 1
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = {}
+        self.changed = False
+
+    def load(self):
+        if os.path.isfile(self.file_path):
+            with open(self.file_path) as inp:
+                data = json.load(inp)
+            if data.get('version') == self.version:
+                self.entries = data.get('notebooks', {})
+            else:
+                print('Manifest version changed, ignoring {}'.format(self.file_path))
+
+    def save(self):
+        if not self.changed:
+            return
+        with atomic_open(self.file_path) as outp:
+            json.dump({'version': self.version, 'notebooks': self.entries},
+                      outp, indent=4, sort_keys=True)
+        self.changed = False
+
+    def get(self, file_name):
+        return self.entries.get(file_name)
+
+    def update(self, file_name, entry):
+        self.entries[file_name] = entry
+        self.changed = True
+
+    def symbols(self, parser_name, parser_version):
+        """Cell symbols of the entries recorded with this version of the parser"""
+        symbols = {}
+        for entry in self.entries.values():
+            if entry.get('parsers', {}).get(parser_name) == parser_version:
+                symbols.update(entry.get('symbols', {}))
+        return symbols
+
+    def is_current(self, entry, parser_versions):
+        if entry.get('parsers') != parser_versions:
+            return False
+        return all(os.path.isfile(path) for path in entry.get('outputs', []))
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'publish-manifest.json')
+            output_path = os.path.join(directory, 'note.ipynb')
+            with open(output_path, 'w') as outp:
+                outp.write('{}')
+            manifest = self.__class__(file_path)
+            manifest.save()
+            assert not os.path.isfile(file_path)
+
+            entry = {'file_hash': 'a', 'content_hash': 'b', 'nbformat': 4,
+                     'parsers': {'python3': 2}, 'outputs': [output_path]}
+            manifest.update('note', entry)
+            manifest.save()
+            manifest = self.__class__(file_path)
+            manifest.load()
+            assert manifest.get('note') == entry
+            assert manifest.symbols('python3', 2) == {}
+
+            entry = dict(entry, symbols={'c': [['os'], [], []]})
+            manifest.update('note', entry)
+            assert manifest.symbols('python3', 2) == {'c': [['os'], [], []]}
+            assert manifest.symbols('python3', 3) == {}
+            assert manifest.is_current(entry, {'python3': 2})
+            assert not manifest.is_current(entry, {'python3': 3})
+            os.remove(output_path)
+            assert not manifest.is_current(entry, {'python3': 2})
+
+            # a manifest of another version is ignored
+            with open(file_path, 'w') as outp:
+                json.dump({'version': self.version + 1, 'notebooks': {'note': entry}}, outp)
+            manifest = self.__class__(file_path)
+            with redirect_stdout(io.StringIO()):
+                manifest.load()
+            assert manifest.get('note') is None
+        finally:
+            shutil.rmtree(directory)
+
+
+class InvertedIndex():
+    """Inverted index of the search pages with what a BM25 ranker needs
+
+    Every term maps to its document frequency followed by one posting per
+    document field, `[doc delta, field, position deltas...]`, so the term
+    frequency is the posting length minus two. Per field token counts are
+    kept for every document as BM25 document lengths.
+    """
+    version = 1
+    fields = ('title', 'tags', 'text')
+    weights = (3.0, 2.0, 1.0)
+    token_pattern = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self):
+        self.docs = []
+        self.lengths = []
+        self.postings = {}
+
+    def tokenize(self, text):
+        return [token.lower() for token in self.token_pattern.findall(text or '')]
+
+    def add(self, page):
+        doc = len(self.docs)
+        self.docs.append({'id': page.get('id'), 'url': page.get('url'), 'title': page.get('title')})
+        lengths = []
+        for field, name in enumerate(self.fields):
+            tokens = self.tokenize(page.get(name))
+            lengths.append(len(tokens))
+            positions = {}
+            for position, token in enumerate(tokens):
+                positions.setdefault(token, []).append(position)
+            for token, token_positions in positions.items():
+                self.postings.setdefault(token, []).append((doc, field, token_positions))
+        self.lengths.append(lengths)
+
+    def _encode_postings(self, postings):
+        encoded = []
+        last_doc = 0
+        for doc, field, positions in postings:
+            deltas = [positions[0]] + [b - a for a, b in zip(positions, positions[1:])]
+            encoded.append([doc - last_doc, field] + deltas)
+            last_doc = doc
+        return [len(set(doc for doc, _, _ in postings))] + encoded
+
+    def dump(self):
+        count = len(self.lengths) or 1
+        return {
+            'version': self.version,
+            'fields': list(self.fields),
+            'weights': list(self.weights),
+            'bm25': {'k1': 1.2, 'b': 0.75},
+            'docs': self.docs,
+            'lengths': self.lengths,
+            'avg_lengths': [sum(lengths[field] for lengths in self.lengths) / count
+                            for field in range(len(self.fields))],
+            'terms': {term: self._encode_postings(postings)
+                      for term, postings in sorted(self.postings.items())}
+            }
+
+
+class SearchIndex():
+    """Tipue search index that is updated in place
+
+    The file is written compactly with one page per line, so entries of pages
+    that did not change are carried over as the exact bytes that were loaded.
+    With `shard_pages` every page is also written to its own file next to a
+    small manifest, so the client can fetch the texts lazily. With
+    `inverted_index` a prebuilt InvertedIndex is written to `inverted.json`.
+    """
+    header = '{"pages":['
+    footer = ']}'
+
+    def __init__(self, file_path, shard_pages=False, inverted_index=False):
+        self.file_path = file_path
+        self.shard_pages = shard_pages
+        self.inverted_index = inverted_index
+        self.entries = {}
+        self.changed = False
+
+    def _shard_path(self, page_id):
+        return 'pages/{}.json'.format(page_id)
+
+    def load(self):
+        """Return the pages of the index, keeping their serialised form for save"""
+        pages = []
+        if not os.path.isfile(self.file_path):
+            return pages
+        with open(self.file_path) as inp:
+            lines = inp.read().split('\n')
+        if lines[0] == self.header and lines[-1] == self.footer:
+            for line in lines[1:-1]:
+                if not line:
+                    # empty index written by an older version
+                    continue
+                entry = line[:-1] if line.endswith(',') else line
+                page = json.loads(entry)
+                self.entries[page.get('id')] = entry
+                pages.append(page)
+        else:
+            # indented index written by an older version, rewrite it on save
+            pages = json.loads('\n'.join(lines)).get('pages', [])
+            for page in pages:
+                self.entries[page.get('id')] = json.dumps(page, separators=(',', ':'))
+            self.changed = True
+        return pages
+
+    def __contains__(self, page_id):
+        return page_id in self.entries
+
+    def update(self, page):
+        self.entries[page['id']] = json.dumps(page, separators=(',', ':'))
+        self.changed = True
+        if self.shard_pages:
+            self._write_shard(page)
+
+    def remove(self, page_id):
+        self.entries.pop(page_id)
+        self.changed = True
+        if self.shard_pages:
+            shard_path = os.path.join(os.path.dirname(self.file_path), self._shard_path(page_id))
+            if os.path.isfile(shard_path):
+                os.remove(shard_path)
+
+    def _manifest_path(self):
+        return os.path.join(os.path.dirname(self.file_path), 'manifest.json')
+
+    def _missing_shards(self):
+        """Ids of the pages whose shard file does not exist"""
+        directory = os.path.dirname(self.file_path)
+        return [page_id for page_id in sorted(self.entries)
+                if not os.path.isfile(os.path.join(directory, self._shard_path(page_id)))]
+
+    def _write_shard(self, page):
+        shard_path = os.path.join(os.path.dirname(self.file_path), self._shard_path(page['id']))
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        with atomic_open(shard_path) as outp:
+            json.dump(page, outp, separators=(',', ':'))
+
+    def _write_manifest(self):
+        manifest = []
+        for page_id in sorted(self.entries):
+            page = json.loads(self.entries[page_id])
+            manifest.append({'id': page_id,
+                             'title': page.get('title'),
+                             'url': page.get('url'),
+                             'tags': page.get('tags'),
+                             'shard': self._shard_path(page_id)})
+        with atomic_open(self._manifest_path()) as outp:
+            json.dump({'pages': manifest}, outp, separators=(',', ':'))
+
+    def _inverted_index_path(self):
+        return os.path.join(os.path.dirname(self.file_path), 'inverted.json')
+
+    def _write_inverted_index(self):
+        # rebuilt from every page, which is why it is opt-in
+        index = InvertedIndex()
+        for page_id in sorted(self.entries):
+            index.add(json.loads(self.entries[page_id]))
+        with atomic_open(self._inverted_index_path()) as outp:
+            json.dump(index.dump(), outp, separators=(',', ':'))
+
+    def save(self):
+        missing_shards = []
+        if self.shard_pages:
+            missing_shards = self._missing_shards()
+            if not os.path.isfile(self._manifest_path()):
+                self.changed = True
+        if self.inverted_index and not os.path.isfile(self._inverted_index_path()):
+            self.changed = True
+        if not self.changed and not missing_shards:
+            return
+        os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+        lines = [self.entries[page_id] for page_id in sorted(self.entries)]
+        with atomic_open(self.file_path) as outp:
+            # no blank line between header and footer for an empty index
+            outp.write('\n'.join([self.header] + ([',\n'.join(lines)] if lines else []) + [self.footer]))
+        if self.shard_pages:
+            # shards of unchanged pages when sharding was just turned on or they were deleted
+            for page_id in missing_shards:
+                self._write_shard(json.loads(self.entries[page_id]))
+            self._write_manifest()
+        if self.inverted_index:
+            self._write_inverted_index()
+        self.changed = False
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'index.json')
+            index = self.__class__(file_path)
+            index.changed = True
+            index.save()
+            assert self.__class__(file_path).load() == []
+
+            page = {'id': 'a', 'title': 'A', 'url': 'a.html', 'tags': 'x, y', 'text': 'some text'}
+            index.update(page)
+            index.update(dict(page, id='b'))
+            index.save()
+            index = self.__class__(file_path)
+            assert index.load() == [page, dict(page, id='b')]
+            assert not index.changed
+
+            index.remove('a')
+            index.remove('b')
+            index.save()
+            assert self.__class__(file_path).load() == []
+        finally:
+            shutil.rmtree(directory)
+
+    def test_inverted_index(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'index.json')
+            inverted_path = os.path.join(directory, 'inverted.json')
+            index = self.__class__(file_path)
+            index.update({'id': 'a', 'title': 'A', 'url': 'a.html', 'tags': 'x', 'text': 'some text'})
+            index.save()
+            assert not os.path.isfile(inverted_path)
+
+            # turning it on for an unchanged index writes it
+            index = self.__class__(file_path, inverted_index=True)
+            index.load()
+            index.save()
+            with open(inverted_path) as inp:
+                inverted = json.load(inp)
+            assert [doc['id'] for doc in inverted['docs']] == ['a']
+            assert inverted['terms']['text'] == [1, [0, 2, 1]]
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shards(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'index.json')
+            page = {'id': 'a', 'title': 'A', 'url': 'a.html', 'tags': 'x', 'text': 'some text'}
+            index = self.__class__(file_path)
+            index.update(page)
+            index.update(dict(page, id='b'))
+            index.save()
+
+            # turning sharding on for an unchanged index writes every shard
+            index = self.__class__(file_path, shard_pages=True)
+            index.load()
+            index.save()
+            with open(os.path.join(directory, 'manifest.json')) as inp:
+                manifest = json.load(inp)
+            assert [entry['shard'] for entry in manifest['pages']] == ['pages/a.json', 'pages/b.json']
+            assert all(os.path.isfile(os.path.join(directory, entry['shard'])) for entry in manifest['pages'])
+
+            # a deleted shard is written again
+            os.remove(os.path.join(directory, 'pages', 'a.json'))
+            index = self.__class__(file_path, shard_pages=True)
+            index.load()
+            index.save()
+            with open(os.path.join(directory, 'pages', 'a.json')) as inp:
+                assert json.load(inp) == page
+        finally:
+            shutil.rmtree(directory)
+
+
 class Publisher():
 
     def __init__(self,
@@ -104,17 +610,31 @@ class Publisher():
                  index_file_path='output/search/index.json',
                  notebook_prefix='ipynb',
                  meta_prefix='ipynb-meta',
-                 default_author='Ramtin Seraj'):
+                 default_author='Ramtin Seraj',
+                 manifest_file_path='publish-manifest.json',
+                 jobs=1,
+                 hardlink=False,
+                 shard_index=False,
+                 inverted_index=False):
         self.content_path = content_path
         self.notebook_path = notebook_path
         self.index_file_path = index_file_path
+        self.search_index = SearchIndex(index_file_path, shard_pages=shard_index,
+                                        inverted_index=inverted_index)
+        self.manifest = BuildManifest(manifest_file_path)
         self.published_meta = {}
         self.notebook_prefix = notebook_prefix
         self.meta_prefix = meta_prefix
         self.default_author = default_author
+        self.jobs = jobs
+        self.hardlink = hardlink
 
         self.md_parser = SimpleMarkdownParser()
         self.py3_parser = SimplePython3Parser()
+        self.nb_parser = SimpleNotebookParser()
+        self.parser_versions = {'markdown': self.md_parser.VERSION,
+                                'python3': self.py3_parser.VERSION,
+                                'notebook': self.nb_parser.VERSION}
 
     def _get_modified_timestamp(self, file):
         return datetime.fromtimestamp(os.path.getmtime(file))
@@ -122,13 +642,6 @@ class Publisher():
     def _get_created_timestamp(self, file):
         return datetime.fromtimestamp(os.path.getctime(file))
 
-    def _load_notebook(self, notebook_filepath, nbformat_version=4):
-        notebook = nbformat.read(notebook_filepath, as_version=nbformat_version)
-        # check nbformat:
-        if not notebook.nbformat == nbformat_version:
-            notebook = nbformat.read(notebook_filepath, as_version=notebook.nbformat)
-        return notebook
-
     def _load_published_meta(self):
         published_files = glob.glob(self.content_path + '*.' + self.meta_prefix)
         for file in published_files:
@@ -141,88 +654,160 @@ class Publisher():
                 self.published_meta[file_name] = meta
 
     def _load_index(self):
-        if os.path.isfile(self.index_file_path):
-            with open(self.index_file_path) as inp:
-                data = json.load(inp)
-                for page in data.get('pages', []):
-                    id = page.get('id')
-                    if id in self.published_meta:
-                        self.published_meta[id].cleaned_text = page.get('text')
-                        self.published_meta[id].url = page.get('url')
-
-    def _save_index(self):
-        data = []
-        for meta in self.published_meta.values():
-            data.append({
-                "text": meta.cleaned_text,
-                "tags": ', '.join(meta.tags),
-                "url": meta.url,
-                "id": meta.id,
-                "title": meta.title
-                })
-        with open(self.index_file_path, 'w') as outp:
-            json.dump({'pages': data}, outp, indent=4)
+        for page in self.search_index.load():
+            id = page.get('id')
+            if id in self.published_meta:
+                self.published_meta[id].cleaned_text = page.get('text')
+                self.published_meta[id].url = page.get('url')
+
+    def _index_page(self, meta):
+        return {
+            "text": meta.cleaned_text,
+            "tags": ', '.join(meta.tags),
+            "url": meta.url,
+            "id": meta.id,
+            "title": meta.title
+            }
+
+    def _save_index(self, updated):
+        for id in list(self.search_index.entries):
+            if id not in self.published_meta:
+                self.search_index.remove(id)
+        for id, meta in self.published_meta.items():
+            if id in updated or id not in self.search_index:
+                self.search_index.update(self._index_page(meta))
+        self.search_index.save()
+
+    def _check_notebook(self, file_name, note_file, data, modified_time):
+        """Return True if the published version of the notebook is up to date"""
+        if file_name not in self.published_meta or file_name not in self.search_index:
+            # the cleaned text only lives in the search index
+            return False
+        file_hash = hashlib.sha1(data).hexdigest()
+        entry = self.manifest.get(file_name)
+        if entry is None:
+            # published before the manifest existed, trust the old timestamp check once
+            if modified_time != self.published_meta[file_name].modified:
+                return False
+            summary = self.nb_parser.process(note_file)
+            self._record_notebook(file_name, file_hash, summary.content_hash, summary.nbformat,
+                                  self._dump_symbols(summary))
+            return True
+        if not self.manifest.is_current(entry, self.parser_versions):
+            return False
+        if entry.get('file_hash') == file_hash:
+            return True
+        summary = self.nb_parser.process(note_file)
+        if entry.get('content_hash') == summary.content_hash and entry.get('nbformat') == summary.nbformat:
+            entry['file_hash'] = file_hash
+            self.manifest.update(file_name, entry)
+            return True
+        return False
+
+    def _record_notebook(self, file_name, file_hash, content_hash, nbformat_version, symbols):
+        self.manifest.update(file_name, {
+            'file_hash': file_hash,
+            'content_hash': content_hash,
+            'nbformat': nbformat_version,
+            'parsers': self.parser_versions,
+            'outputs': [self.content_path + file_name + '.' + self.notebook_prefix,
+                        self.content_path + file_name + '.' + self.meta_prefix],
+            'symbols': symbols
+            })
 
     def _discover_notebooks(self):
-        notebook_files = glob.glob(self.notebook_path + '*.' + self.notebook_prefix)
-        for note_file in notebook_files:
-            file_name = note_file[len(self.notebook_path):-len(self.notebook_prefix)-1]
-            date_time = self._get_created_timestamp(note_file).strftime("%Y-%m-%d %H:%M")
-            modified_time = self._get_modified_timestamp(note_file).strftime("%Y-%m-%d %H:%M")
-            if file_name in self.published_meta:
-                # check timestamp
-                if modified_time == self.published_meta[file_name].modified:
-                    print('no change for {} '.format(file_name))
-                else:
-                    print('date not match for {}'.format(file_name))
-                    notebook = self._load_notebook(note_file)
-                    meta = self._publish_new_notebook(notebook, file_name, date_time, modified_time)
-                    self._copy_notebook_to_content(notebook, file_name)
-                    meta_file_path = self.content_path + file_name + '.' + self.meta_prefix
-                    meta.dump_markdown_file(meta_file_path)
-                    self.published_meta[file_name] = meta
-                    print('{} updated!'.format(file_name))
-            else:
-                print('found new one {}'.format(file_name))
-                notebook = self._load_notebook(note_file)
-                meta = self._publish_new_notebook(notebook, file_name, date_time, modified_time)
-                self._copy_notebook_to_content(notebook, file_name)
-                meta_file_path = self.content_path + file_name + '.' + self.meta_prefix
-                meta.dump_markdown_file(meta_file_path)
-                self.published_meta[file_name] = meta
-                print('{} published!'.format(file_name))
+        notebook_files = sorted(glob.glob(self.notebook_path + '*.' + self.notebook_prefix))
+        return [task for task in map(self._discover_notebook, notebook_files) if task is not None]
+
+    def _discover_notebook(self, note_file):
+        """Return the NotebookTask to publish note_file or None if it is up to date"""
+        file_name = note_file[len(self.notebook_path):-len(self.notebook_prefix)-1]
+        date_time = self._get_created_timestamp(note_file).strftime("%Y-%m-%d %H:%M")
+        modified_time = self._get_modified_timestamp(note_file).strftime("%Y-%m-%d %H:%M")
+        with tracer.span('check', file=file_name) as span:
+            with open(note_file, 'rb') as inp:
+                data = inp.read()
+            span['bytes'] = len(data)
+            up_to_date = self._check_notebook(file_name, note_file, data, modified_time)
+        if up_to_date:
+            print('no change for {} '.format(file_name))
+            return None
+
+        if file_name in self.published_meta:
+            print('content changed for {}'.format(file_name))
+        else:
+            print('found new one {}'.format(file_name))
+        return NotebookTask(file_name, note_file, date_time, modified_time, hashlib.sha1(data).hexdigest())
+
+    def _publish_notebook(self, task):
+        with tracer.span('parse', file=task.file_name, bytes=os.path.getsize(task.file_path)):
+            summary = self.nb_parser.process(task.file_path)
+        meta = self._publish_new_notebook(summary, task.file_name, task.date, task.modified)
+        with tracer.span('copy', file=task.file_name):
+            self._copy_notebook_to_content(task.file_path, task.file_name)
+        meta_file_path = self.content_path + task.file_name + '.' + self.meta_prefix
+        with tracer.span('meta write', file=task.file_name):
+            meta.dump_markdown_file(meta_file_path)
+        # symbols found by workers come back with the result to be kept in the manifest
+        return meta, summary.content_hash, summary.nbformat, self._dump_symbols(summary)
+
+    def _merge_published_notebook(self, task, meta, content_hash, nbformat_version, symbols):
+        self._record_notebook(task.file_name, task.file_hash, content_hash, nbformat_version, symbols)
+        if task.file_name in self.published_meta:
+            print('{} updated!'.format(task.file_name))
+        else:
+            print('{} published!'.format(task.file_name))
+        self.published_meta[task.file_name] = meta
+
+    def _publish_notebooks(self, tasks):
+        if self.jobs > 1 and len(tasks) > 1:
+            # results come back in task order and worker output is replayed
+            # here, so the log reads the same as a serial run
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(tasks)),
+                                     initializer=_init_worker,
+                                     initargs=(self, tracer.enabled)) as executor:
+                for task, (result, output, events) in zip(tasks, executor.map(_publish_in_worker, tasks)):
+                    sys.stdout.write(output)
+                    tracer.merge(events)
+                    self._merge_published_notebook(task, *result)
+        else:
+            for task in tasks:
+                self._merge_published_notebook(task, *self._publish_notebook(task))
+
+    def _parses_python(self, notebook):
+        """True if the code cells of the notebook go through the python parser"""
+        return notebook.language_info.get('name') == 'python' and \
+            notebook.language_info.get('version', '').startswith('2.')
+
+    def _dump_symbols(self, notebook):
+        if not self._parses_python(notebook):
+            return {}
+        return self.py3_parser.dump_symbols(source for cell_type, source in notebook.cells if cell_type == "code")
 
     def _publish_new_notebook(self, notebook, file_name, date, modified):
-        lang = notebook.metadata.get('language_info', {}).get('name')
-        lang_version = notebook.metadata.get('language_info', {}).get('version')
+        lang = notebook.language_info.get('name')
 
-        title = ""
-        summary = ""  # first
-        cleaned_text = ""
+        markdown_sources = []
         category = None
         tags = []
-        for cell in notebook.cells or []:
-            cell_type = cell.get('cell_type')
-            if cell_type == "heading":
-                title = cell.get('source')
-            elif cell_type == "markdown":
-                res = self.md_parser.process(cell.get('source'))
-                if not title:
-                    title = res[0]
-                if not summary:
-                    summary = res[1]
-                cleaned_text += '\n' + res[1]
+        for cell_type, source in notebook.cells:
+            if cell_type == "markdown":
+                markdown_sources.append(source)
             elif cell_type == "code":
                 # process python code
                 if lang == 'python':
                     category = "python"
-                if lang == 'python' and lang_version.startswith('2.'):
-                    packages, classes, methods = self.py3_parser.process(cell.get('source'))
+                if self._parses_python(notebook):
+                    with tracer.span('python parse', file=file_name, bytes=len(source)):
+                        packages, classes, methods = self.py3_parser.process(source)
                     for p in packages:
                         tags += ['python_package: {}'.format(p)]
                     if classes:
                         print(classes)
 
+        with tracer.span('markdown clean', file=file_name, bytes=sum(len(source) for source in markdown_sources)):
+            title, summary, cleaned_text = self.md_parser.process_many(markdown_sources)
+
         meta = Meta(id=file_name,
                     title=title,
                     date=date,
@@ -238,30 +823,257 @@ class Publisher():
             meta.summary = summary
         return meta
 
-    def _copy_notebook_to_content(self, notebook, file_name, remove_outputs=False):
-        if remove_outputs:
-            remove_metadata_fields = {'collapsed', 'scrolled'}
-            for cell in notebook.cells or []:
-                if cell.cell_type == "code":
-                    cell.outputs = []
-                    cell.execution_count = None
-                    # Remove metadata associated with output
-                    if 'metadata' in cell:
-                        for field in remove_metadata_fields:
-                            cell.metadata.pop(field, None)
+    def _copy_notebook_to_content(self, note_file, file_name, remove_outputs=False):
+        file_path = self.content_path + file_name + '.' + self.notebook_prefix
+        if not remove_outputs:
+            # nothing to change, publish the original bytes
+            copy_file(note_file, file_path, hardlink=self.hardlink)
+            return
+
+        with open(note_file, 'rb') as inp:
+            notebook = json.loads(inp.read().decode('utf-8'))
+        cells = notebook.get('cells')
+        if cells is None:
+            # nbformat 3
+            cells = [cell for worksheet in notebook.get('worksheets', []) for cell in worksheet.get('cells', [])]
+        remove_metadata_fields = {'collapsed', 'scrolled'}
+        for cell in cells:
+            if cell.get('cell_type') == "code":
+                cell['outputs'] = []
+                if 'prompt_number' in cell:
+                    del cell['prompt_number']
+                else:
+                    cell['execution_count'] = None
+                # Remove metadata associated with output
+                for field in remove_metadata_fields:
+                    cell.get('metadata', {}).pop(field, None)
 
         # write to file
-        file_path = self.content_path + file_name + '.' + self.notebook_prefix
-        with open(file_path, 'w') as outp:
-            json.dump(notebook, outp, indent=4)
+        with atomic_open(file_path) as outp:
+            json.dump(notebook, outp, separators=(',', ':'))
+
+    def _load(self):
+        with tracer.span('load'):
+            self._load_published_meta()
+            print(self.published_meta)
+            self.manifest.load()
+            self.py3_parser.clear_cache()
+            self.py3_parser.load_symbols(self.manifest.symbols('python3', self.py3_parser.VERSION))
+            self._load_index()
+
+    def _publish_tasks(self, tasks):
+        with tracer.span('publish'):
+            self._publish_notebooks(tasks)
+        self._save(tasks)
+
+    def _save(self, tasks):
+        with tracer.span('index save'):
+            self._save_index([task.file_name for task in tasks])
+        with tracer.span('manifest save'):
+            self.manifest.save()
 
     def publish(self):
-        self._load_published_meta()
-        print(self.published_meta)
-        self._load_index()
-        self._discover_notebooks()
-        self._save_index()
+        self._load()
+        with tracer.span('discover'):
+            tasks = self._discover_notebooks()
+        self._publish_tasks(tasks)
+
+    def publish_changed(self, note_files):
+        """
+        Publish only the given notebooks, the published state must be loaded
+        Notebooks that fail (e.g. saved halfway) are reported and left as they were published
+        """
+        tasks = []
+        for note_file in sorted(note_files):
+            try:
+                task = self._discover_notebook(note_file)
+                if task is None:
+                    continue
+                with tracer.span('publish'):
+                    self._publish_notebooks([task])
+            except Exception as e:
+                print('could not publish {}: {}: {}'.format(note_file, type(e).__name__, e))
+                continue
+            tasks.append(task)
+        if tasks:
+            self._save(tasks)
+        return tasks
+
+    def watch(self, debounce=0.2, poll_interval=0.5, use_events=True):
+        """Publish everything, then keep publishing notebooks as they are saved"""
+        try:
+            self.publish()
+        except Exception as e:
+            print('could not publish all notebooks ({}: {}), publishing them one by one'.format(type(e).__name__, e))
+            self.publish_changed(glob.glob(self.notebook_path + '*.' + self.notebook_prefix))
+        watcher = NotebookWatcher(self.notebook_path, self.notebook_prefix,
+                                  poll_interval=poll_interval, use_events=use_events)
+        watcher.start()
+        print('watching {} ({})'.format(self.notebook_path, 'events' if watcher.use_events else 'polling'))
+        try:
+            while True:
+                changed = watcher.wait(debounce)
+                start = time.time()
+                # deleted notebooks stay published, as with a full publish
+                try:
+                    tasks = self.publish_changed([path for path in changed if os.path.isfile(path)])
+                except Exception as e:
+                    # e.g. the index could not be written, keep watching
+                    print('could not publish {}: {}: {}'.format(', '.join(sorted(changed)), type(e).__name__, e))
+                    continue
+                if tasks:
+                    print('published {} notebook(s) in {:.0f} ms'.format(len(tasks), (time.time() - start) * 1e3))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.stop()
+
+    def test_nbformat3_title(self):
+        notebook = {'metadata': {'name': ''}, 'nbformat': 3, 'nbformat_minor': 0,
+                    'worksheets': [{'metadata': {}, 'cells': [
+                        {'cell_type': 'heading', 'level': 1, 'metadata': {}, 'source': ['Main Title']},
+                        {'cell_type': 'markdown', 'metadata': {}, 'source': ['Intro text.']},
+                        {'cell_type': 'heading', 'level': 2, 'metadata': {}, 'source': ['Conclusion']},
+                        {'cell_type': 'markdown', 'metadata': {}, 'source': ['The end.']}]}]}
+        summary = self.nb_parser._process_test_notebook(notebook)
+        meta = self._publish_new_notebook(summary, 'v3', '2020-01-01 00:00', '2020-01-01 00:00')
+        assert meta.title == 'Main Title'
+        assert meta.summary == 'Intro text.'
+        assert meta.cleaned_text == '\n\nIntro text.\n\nThe end.'
+
+    def test_skip_unchanged(self):
+        directory = tempfile.mkdtemp()
+        try:
+            notebook_path = os.path.join(directory, 'notebooks') + os.sep
+            content_path = os.path.join(directory, 'content') + os.sep
+            os.makedirs(notebook_path)
+            os.makedirs(content_path)
+            notebook = {'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title\n', 'Some text.']},
+                                  {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'outputs': [],
+                                   'source': ['import os']}],
+                        'metadata': {'language_info': {'name': 'python', 'version': '3.6.3'}},
+                        'nbformat': 4, 'nbformat_minor': 2}
+            note_file = notebook_path + 'note.ipynb'
+
+            def write(notebook, indent=1):
+                with open(note_file, 'w') as outp:
+                    json.dump(notebook, outp, indent=indent)
+
+            def discover():
+                publisher = self.__class__(content_path=content_path, notebook_path=notebook_path,
+                                           index_file_path=os.path.join(directory, 'search', 'index.json'),
+                                           manifest_file_path=os.path.join(directory, 'publish-manifest.json'))
+                with redirect_stdout(io.StringIO()):
+                    publisher._load()
+                    tasks = publisher._discover_notebooks()
+                    publisher._publish_tasks(tasks)
+                return [task.file_name for task in tasks]
+
+            write(notebook)
+            assert discover() == ['note']
+            assert discover() == []
+            # other bytes for the same cells, skipped through the content hash
+            write(notebook, indent=2)
+            assert discover() == []
+            notebook['cells'][0]['source'] = ['# Title\n', 'Other text.']
+            write(notebook)
+            assert discover() == ['note']
+        finally:
+            shutil.rmtree(directory)
+
+    def test_symbols_kept(self):
+        directory = tempfile.mkdtemp()
+        try:
+            notebook_path = os.path.join(directory, 'notebooks') + os.sep
+            content_path = os.path.join(directory, 'content') + os.sep
+            manifest_file_path = os.path.join(directory, 'publish-manifest.json')
+            os.makedirs(notebook_path)
+            os.makedirs(content_path)
+            notebook = {'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title']},
+                                  {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'outputs': [],
+                                   'source': ['import urllib2']}],
+                        'metadata': {'language_info': {'name': 'python', 'version': '2.7.15'}},
+                        'nbformat': 4, 'nbformat_minor': 2}
+            key = self.py3_parser._cache_key('import urllib2')
+
+            def publish(notebook):
+                with open(notebook_path + 'note.ipynb', 'w') as outp:
+                    json.dump(notebook, outp)
+                publisher = self.__class__(content_path=content_path, notebook_path=notebook_path,
+                                           index_file_path=os.path.join(directory, 'search', 'index.json'),
+                                           manifest_file_path=manifest_file_path)
+                with redirect_stdout(io.StringIO()):
+                    publisher.publish()
+                with open(manifest_file_path) as inp:
+                    return json.load(inp)['notebooks']['note']
+
+            entry = publish(notebook)
+            assert entry['symbols'] == {key: [['urllib2'], [], []]}
+
+            # the next run takes the symbols of unchanged cells from the manifest
+            entry['symbols'][key] = [['cached'], [], []]
+            with open(manifest_file_path, 'w') as outp:
+                json.dump({'version': BuildManifest.version, 'notebooks': {'note': entry}}, outp)
+            notebook['cells'][0]['source'] = ['# Other title']
+            entry = publish(notebook)
+            assert entry['symbols'] == {key: [['cached'], [], []]}
+            with open(content_path + 'note.ipynb-meta') as inp:
+                assert 'python_package: cached' in inp.read()
+        finally:
+            shutil.rmtree(directory)
+
+
+def _init_worker(publisher, profile=False):
+    global _worker_publisher
+    _worker_publisher = publisher
+    if profile:
+        tracer.enable()
+        # forked workers start with the spans of the parent
+        tracer.drain()
+
+
+def _publish_in_worker(task):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        result = _worker_publisher._publish_notebook(task)
+    return result, output.getvalue(), tracer.drain()
+
 
 if __name__ == "__main__":
-    Publisher().publish()
+    parser = argparse.ArgumentParser(description='Publish notebooks to the pelican content folder')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of notebooks to publish in parallel (0 uses all cores)')
+    parser.add_argument('--hardlink', action='store_true',
+                        help='hard link notebooks into the content folder instead of copying them, '
+                             'only safe if notebooks are saved atomically (the Jupyter default)')
+    parser.add_argument('--shard-index', action='store_true',
+                        help='also write every search index page to its own file with a manifest')
+    parser.add_argument('--inverted-index', action='store_true',
+                        help='also write a prebuilt inverted index (search/inverted.json), '
+                             'rebuilt from every page whenever the index changes')
+    parser.add_argument('--profile', nargs='?', const=True, metavar='TRACE',
+                        help='print the time spent per stage and notebook, '
+                             'and write a Chrome trace (chrome://tracing) to TRACE if given')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and publish notebooks as soon as they are saved')
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, poll the notebooks instead of using filesystem events (watchdog)')
+    parser.add_argument('--debounce', type=float, default=0.2,
+                        help='with --watch, seconds without changes to wait before publishing')
+    args = parser.parse_args()
+
+    if args.profile:
+        tracer.enable()
+    publisher = Publisher(jobs=args.jobs or os.cpu_count(),
+                          hardlink=args.hardlink,
+                          shard_index=args.shard_index,
+                          inverted_index=args.inverted_index)
+    if args.watch:
+        publisher.watch(debounce=args.debounce, use_events=not args.poll)
+    else:
+        publisher.publish()
+    if args.profile:
+        print(tracer.summary())
+        if args.profile is not True:
+            tracer.save(args.profile)
     # add data to tipue search
@@ -0,0 +1,223 @@
+"""
+Development HTTP server for the generated site
+
+Serves `output/` with one thread per connection, keeps small files in memory
+(invalidated by mtime), answers `If-None-Match`/`If-Modified-Since` with 304,
+serves the `.br`/`.gz` files written next to a file when the client accepts
+them and sends large files with `sendfile`.
+
+    python server.py [PORT] [BIND] [--directory output]
+"""
+import argparse
+import email.utils
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+CachedFile = namedtuple('CachedFile', ['mtime_ns', 'size', 'etag', 'last_modified', 'data'])
+
+# Content-Encoding of the precompressed siblings, by order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class FileCache():
+    """
+    Stat results and content of the served files
+
+    Entries are checked against the mtime and size of the file on every
+    request. Files above `max_file_size` are not kept in memory, the total is
+    kept under `max_size` by dropping the least recently used files.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024, max_file_size=1024 * 1024):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Return the CachedFile of path (data is None for large files) or None if it does not exist"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(path)
+                return entry
+
+        data = None
+        if stat.st_size <= self.max_file_size:
+            try:
+                with open(path, 'rb') as inp:
+                    data = inp.read()
+            except OSError:
+                return None
+            if len(data) != stat.st_size:
+                # written while we read it, serve it but don't keep it
+                return CachedFile(stat.st_mtime_ns, len(data), None, None, data)
+        entry = CachedFile(stat.st_mtime_ns, stat.st_size,
+                           '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size),
+                           email.utils.formatdate(stat.st_mtime, usegmt=True), data)
+        if data is not None:
+            self._add(path, entry)
+        return entry
+
+    def _add(self, path, entry):
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[path] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= dropped.size
+
+
+class DevRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler resolving pelican urls (`/page` to `page.html`, `/page/` to `page/index.html`)
+    """
+    protocol_version = 'HTTP/1.1'
+    cache = FileCache()
+
+    def do_GET(self):
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def resolve(self):
+        """Path of the file to serve for the request or None"""
+        path = self.translate_path(self.path)
+        candidates = [path]
+        if not path.endswith('/'):
+            candidates.append(path + '.html')
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        if os.path.isdir(path) and path.endswith('/'):
+            index = os.path.join(path, 'index.html')
+            if os.path.isfile(index):
+                return index
+        # a directory without trailing slash is redirected by the stock handler,
+        # so relative urls of its index resolve against the directory
+        return None
+
+    def accepted_encodings(self):
+        accepted = set()
+        for part in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = part.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(name.strip().lower())
+        return accepted
+
+    def precompressed(self, path, entry):
+        """(encoding, path, CachedFile) of a precompressed sibling not older than the file, or None"""
+        accepted = self.accepted_encodings()
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted:
+                sibling = self.cache.get(path + suffix)
+                if sibling is not None and sibling.mtime_ns >= entry.mtime_ns:
+                    return encoding, path + suffix, sibling
+        return None
+
+    def not_modified(self, entry):
+        if entry.etag is None:
+            return False
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(',')]
+            return '*' in etags or entry.etag in etags or 'W/' + entry.etag in etags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError):
+                return False
+            return since is not None and entry.mtime_ns // 10 ** 9 <= since.timestamp()
+        return False
+
+    def serve(self, head):
+        path = self.resolve()
+        if path is None:
+            # directory listings, redirects and 404 of the stock handler
+            return super().do_HEAD() if head else super().do_GET()
+        entry = self.cache.get(path)
+        if entry is None:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return
+
+        content_type = self.guess_type(path)
+        encoding = None
+        compressed = self.precompressed(path, entry)
+        if compressed is not None:
+            encoding, path, entry = compressed
+
+        if self.not_modified(entry):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_validators(entry)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(entry.size))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_validators(entry)
+        self.end_headers()
+        if head:
+            return
+        if entry.data is not None:
+            self.wfile.write(entry.data)
+            return
+        try:
+            with open(path, 'rb') as inp:
+                # os.sendfile where available, the file never goes through python
+                self.connection.sendfile(inp, count=entry.size)
+        except OSError:
+            self.close_connection = True
+
+    def send_validators(self, entry):
+        if entry.etag is not None:
+            self.send_header('ETag', entry.etag)
+            self.send_header('Last-Modified', entry.last_modified)
+        self.send_header('Vary', 'Accept-Encoding')
+        # always revalidate so rebuilt pages show up, a 304 is cheap
+        self.send_header('Cache-Control', 'no-cache')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the generated site for development')
+    parser.add_argument('port', type=int, nargs='?', default=8000)
+    parser.add_argument('bind', nargs='?', default='', help='interface to listen on, all by default')
+    parser.add_argument('-d', '--directory', default='output', help='directory to serve')
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.directory)
+
+    class Handler(DevRequestHandler):
+        def __init__(self, *handler_args, **kwargs):
+            super().__init__(*handler_args, directory=directory, **kwargs)
+
+    server = ThreadingHTTPServer((args.bind, args.port), Handler)
+    server.daemon_threads = True
+    sys.stderr.write('Serving {} on port {} ...\n'.format(directory, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()